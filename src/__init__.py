@@ -1 +1,13 @@
-from .manhattan import count_positive_neighborhood_size
\ No newline at end of file
+from .manhattan import (
+    ENGINES,
+    count_center_neighborhood_size,
+    count_positive_neighborhood_size,
+    count_positive_neighborhood_sizes,
+    diamond_offsets,
+    manhattan_distance_to_positive,
+    set_stencil_cache_size,
+)
+from .batch import count_positive_neighborhood_size_batch, count_positive_neighborhood_size_ragged
+from .parallel import count_many, count_positive_neighborhood_size_clustered, count_positive_neighborhood_size_tiled
+from .streaming import iter_positive_neighborhood_counts
+from .incremental import CoverageIndex, update_coverage
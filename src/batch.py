@@ -0,0 +1,145 @@
+import numpy as np
+
+import typing as T
+
+from .manhattan import _covered_mask, _distance_transform
+
+
+def count_positive_neighborhood_size_batch(
+    X: np.ndarray,
+    radius: T.Union[int, np.ndarray],
+    wraparound: bool=False
+) -> np.ndarray:
+    """
+    Same as `count_positive_neighborhood_size` for a stack of grids of the same shape. The dilation or distance
+    transform runs on the whole stack at once, so the Python overhead is paid once per batch instead of once per grid.
+
+    :param X: 3D Numpy array of shape (N, H, W), compared greater than 0 like in `count_positive_neighborhood_size`.
+    :param radius: Radius of Manhattan neighborhood, either one for the whole batch or an array of N radii.
+    :param wraparound: Points outside of the grid are discarded by default, if true wrap them around instead.
+    :return: Integer array of N counts.
+    """
+
+    if len(X.shape) != 3:
+        raise ValueError("X must be a 3-dimensional array of shape (N, H, W)")
+
+    radius = np.asarray(radius, dtype=np.int64)
+
+    if radius.ndim > 1 or (radius.ndim == 1 and len(radius) != len(X)):
+        raise ValueError("radius must be a single radius or one radius per grid")
+
+    if (radius < 0).any():
+        raise ValueError("radius must not be negative")
+
+    mask = X > 0
+
+    if radius.ndim == 0:
+        return np.count_nonzero(_covered_mask(mask, int(radius), wraparound), axis=(1, 2))
+
+    dist = _distance_transform(mask, wraparound)
+    counts = np.count_nonzero(dist <= radius.reshape(-1, 1, 1), axis=(1, 2))
+
+    # The distance map fills grids with no positive entries with H + W, which a large enough radius still reaches
+    counts[~mask.any(axis=(1, 2))] = 0
+
+    return counts
+
+
+def _shelf_pack(shapes: T.Sequence[T.Tuple[int, int]], gap: int) -> T.Tuple[np.ndarray, T.Tuple[int, int]]:
+    """
+    Place rectangles on a canvas in rows ("shelves"), tallest first, with at least `gap` empty cells between any two.
+
+    :param shapes: (height, width) of each rectangle.
+    :param gap: Empty cells to leave between rectangles.
+    :return: (top, left) of each rectangle in input order, and the (height, width) of the canvas.
+    """
+
+    heights = np.array([shape[0] for shape in shapes], dtype=np.int64)
+    widths = np.array([shape[1] for shape in shapes], dtype=np.int64)
+
+    # Aim for a roughly square canvas
+    target = max(int(widths.max()), int(np.sqrt(((heights + gap) * (widths + gap)).sum())))
+
+    positions = np.zeros((len(shapes), 2), dtype=np.int64)
+    top = left = shelf_height = canvas_width = 0
+
+    for i in np.argsort(-heights, kind="stable"):
+        if left > 0 and left + widths[i] > target:
+            top, left, shelf_height = top + shelf_height + gap, 0, 0
+
+        positions[i] = top, left
+        canvas_width = max(canvas_width, left + widths[i])
+        left += widths[i] + gap
+        shelf_height = max(shelf_height, heights[i])
+
+    return positions, (int(top + shelf_height), int(canvas_width))
+
+
+def count_positive_neighborhood_size_ragged(
+    grids: T.Sequence[np.ndarray],
+    radius: int,
+    wraparound: bool=False
+) -> np.ndarray:
+    """
+    Same as `count_positive_neighborhood_size` for many grids of different shapes. The grids are packed onto a single
+    canvas separated by guard bands `radius` cells wide, so no diamond reaches from one grid into another, and the whole
+    canvas is dilated in one pass. Counts per grid are then read off a summed-area table.
+
+    With wraparound each grid is first padded with `radius` cells copied from its opposite edges, which turns the
+    wrapped problem into a clipped one on the padded grid.
+
+    :param grids: 2D Numpy arrays of values, compared greater than 0 like in `count_positive_neighborhood_size`.
+    :param radius: Radius of Manhattan neighborhood around each positive center point.
+    :param wraparound: Points outside of the grid are discarded by default, if true wrap them around instead.
+    :return: Integer array with one count per grid.
+    """
+
+    masks = [np.asarray(grid) > 0 for grid in grids]
+
+    if any(mask.ndim != 2 for mask in masks):
+        raise ValueError("every grid must be a 2-dimensional array")
+
+    if radius < 0:
+        raise ValueError("radius must not be negative")
+
+    counts = np.zeros(len(masks), dtype=np.int64)
+
+    # Grids without positives count nothing, and grids where the radius reaches every cell from any positive are full.
+    # Neither needs to go on the canvas, which also keeps the guard bands from blowing up the canvas on huge radii.
+    pending = []
+    for i, mask in enumerate(masks):
+        height, width = mask.shape
+        reach = height // 2 + width // 2 if wraparound else height + width - 2
+
+        if not mask.any():
+            continue
+        elif radius >= reach:
+            counts[i] = height * width
+        else:
+            pending.append(i)
+
+    if not pending:
+        return counts
+
+    pad = radius if wraparound else 0
+    items = [np.pad(masks[i], pad, mode="wrap") if wraparound else masks[i] for i in pending]
+
+    positions, canvas_shape = _shelf_pack([item.shape for item in items], gap=radius)
+
+    canvas = np.zeros(canvas_shape, dtype=bool)
+    for item, (top, left) in zip(items, positions):
+        canvas[top:top + item.shape[0], left:left + item.shape[1]] = item
+
+    covered = np.zeros((canvas_shape[0] + 1, canvas_shape[1] + 1), dtype=np.int64)
+    covered[1:, 1:] = _covered_mask(canvas, radius)
+    np.cumsum(covered, axis=0, out=covered)
+    np.cumsum(covered, axis=1, out=covered)
+
+    # Only the original cells count, not the padding copied in for wraparound
+    tops, lefts = positions[:, 0] + pad, positions[:, 1] + pad
+    bottoms = tops + np.array([masks[i].shape[0] for i in pending])
+    rights = lefts + np.array([masks[i].shape[1] for i in pending])
+
+    counts[pending] = covered[bottoms, rights] - covered[tops, rights] - covered[bottoms, lefts] + covered[tops, lefts]
+
+    return counts
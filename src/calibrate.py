@@ -0,0 +1,164 @@
+"""
+Measure how fast each counting engine is on this machine and store the result for the engine dispatcher.
+
+    python -m src.calibrate [--output PATH] [--quick]
+
+Each engine is timed on synthetic grids across shapes, densities and radii. Its cost is the median of measured seconds
+per unit of work from the dispatcher's cost model, after taking off the fixed cost of its interpreted steps, which is
+measured separately. Together these set where the crossovers between engines fall. The costs are written as JSON to
+`engine_costs_path()` (or `--output`) and picked up by `src.manhattan` at import.
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+import typing as T
+
+from .manhattan import (
+    ENGINES,
+    _ENGINE_COSTS,
+    _ISOLATION_STEPS,
+    _engine_cost,
+    _engine_steps,
+    _engine_work,
+    _overlap_pairs,
+    _run_engine,
+    engine_costs_path,
+)
+
+# (height, width, density, radius) of the synthetic grids
+DEFAULT_CASES = [
+    (64, 64, 0.05, 2),
+    (256, 256, 0.01, 8),
+    (256, 256, 0.2, 1),
+    (1000, 1000, 0.001, 10),
+    (1000, 1000, 0.01, 40),
+    (2000, 2000, 0.0005, 200),
+    (500, 4000, 0.002, 25),
+]
+
+QUICK_CASES = [
+    (64, 64, 0.05, 2),
+    (256, 256, 0.01, 8),
+    (500, 500, 0.001, 60),
+]
+
+
+def calibrate(
+    cases: T.Sequence[T.Tuple[int, int, float, int]]=DEFAULT_CASES,
+    repeats: int=3,
+    budget: float=2.0,
+    seed: int=0
+) -> T.Dict[str, float]:
+    """
+    Time every engine on every case and fit its cost per unit of work.
+
+    :param cases: (height, width, density, radius) of each synthetic grid.
+    :param repeats: Runs per engine and case, the fastest one is kept.
+    :param budget: Skip runs the current cost model expects to take longer than this many seconds.
+    :param seed: Seed for the synthetic grids.
+    :return: Map from engine name to seconds per unit of work, plus "step" for seconds per interpreted step and
+     "isolation" for seconds per n log n unit of finding isolated centers. Engines that were never run keep their
+     current cost.
+    """
+
+    rng = np.random.default_rng(seed)
+    samples = {method: [] for method in ENGINES}
+    isolation = []
+    step = _time_step()
+
+    for height, width, density, radius in cases:
+        mask = rng.random((height, width)) < density
+        rows, cols = (axis.astype(np.int64) for axis in np.nonzero(mask))
+
+        if len(rows) == 0:
+            continue
+
+        if len(rows) > 1:
+            elapsed = min(_time_isolation(rows, cols, radius) for _ in range(repeats)) - step * _ISOLATION_STEPS
+            if elapsed > 0:
+                isolation.append(elapsed / (len(rows) * np.log2(len(rows))))
+
+        for wraparound in (False, True):
+            for method in ENGINES:
+                if _engine_cost(method, (height, width), len(rows), radius, wraparound) > budget:
+                    continue
+
+                elapsed = min(
+                    _time_engine(method, mask, rows, cols, radius, wraparound) for _ in range(repeats)
+                )
+                elapsed -= step * _engine_steps(method, (height, width), len(rows), radius, wraparound)
+                work = _engine_work(method, (height, width), len(rows), radius, wraparound)
+
+                # Runs made almost entirely of overhead say nothing about the per-unit cost
+                if elapsed > 0:
+                    samples[method].append(elapsed / work)
+
+    costs = {
+        method: float(np.median(times)) if times else _ENGINE_COSTS[method]
+        for method, times in samples.items()
+    }
+    costs["step"] = step
+    costs["isolation"] = float(np.median(isolation)) if isolation else _ENGINE_COSTS["isolation"]
+
+    return costs
+
+
+def _time_step(repeats: int=20000) -> float:
+    # Seconds for one tiny NumPy call on slices, the unit of interpreted overhead in the cost model
+    a, b = np.zeros(8), np.ones(8)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        np.minimum(a[1:], b[:-1] + 1, out=a[1:])
+
+    return (time.perf_counter() - start) / repeats
+
+
+def _time_engine(method: str, mask: np.ndarray, rows: np.ndarray, cols: np.ndarray, radius: int, wraparound: bool):
+    start = time.perf_counter()
+    _run_engine(method, mask, rows, cols, mask.shape, radius, wraparound)
+
+    return time.perf_counter() - start
+
+
+def _time_isolation(rows: np.ndarray, cols: np.ndarray, radius: int) -> float:
+    start = time.perf_counter()
+    _overlap_pairs(rows, cols, radius)
+
+    return time.perf_counter() - start
+
+
+def write_engine_costs(costs: T.Dict[str, float], path: T.Optional[str]=None) -> str:
+    # Store costs in the format `load_engine_costs` reads, returns where they went
+    path = engine_costs_path() if path is None else path
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"engine_costs": costs}, f, indent=2, sort_keys=True)
+
+    return path
+
+
+def main(argv: T.Optional[T.Sequence[str]]=None):
+    parser = argparse.ArgumentParser(description="Calibrate the neighborhood counting engine dispatcher.")
+    parser.add_argument("--output", default=None, help=f"Where to write the costs, default {engine_costs_path()}")
+    parser.add_argument("--quick", action="store_true", help="Only run a few small cases")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per engine and case, the fastest one is kept")
+    args = parser.parse_args(argv)
+
+    costs = calibrate(QUICK_CASES if args.quick else DEFAULT_CASES, repeats=args.repeats)
+    path = write_engine_costs(costs, args.output)
+
+    for method in ENGINES:
+        print(f"{method:>10} {costs[method]:.3g} s/unit")
+    print(f"{'step':>10} {costs['step']:.3g} s")
+    print(f"{'isolation':>10} {costs['isolation']:.3g} s/unit")
+    print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
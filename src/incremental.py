@@ -0,0 +1,231 @@
+import numpy as np
+
+import typing as T
+
+from .manhattan import _ENUMERATE_CHUNK_CELLS, _expand_runs, _row_intervals
+
+
+def _coverage_from_runs(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    size: T.Tuple[int, int],
+    radius: int,
+    wraparound: bool=False
+) -> np.ndarray:
+    """
+    Number of centers within a Manhattan radius of every cell, from a difference array along each row. Every run from
+    `_row_intervals` stamps +1 at its first cell and -1 just past its last, and a cumulative sum along the rows turns
+    the stamps into coverage. The runs of one center never overlap, even for a wrapped diamond big enough to reach
+    around onto itself, so each center counts once per cell.
+
+    Memory is O(H * W) plus a bounded chunk of runs, whatever the shape of the grid.
+
+    :param rows: Integer array of center rows.
+    :param cols: Integer array of center columns.
+    :param size: Pair giving the dimensions of the overall array.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param wraparound: Wrap neighborhoods around the edges of the grid instead of clipping them.
+    :return: int32 array of shape `size` with the number of diamonds covering each cell.
+    """
+
+    height, width = size
+    stamps = np.zeros((height, width + 1), dtype=np.int32)
+    flat = stamps.reshape(-1)
+
+    # Each center has at most one run per row, plus one more for each row that wraps around the side
+    chunk = max(_ENUMERATE_CHUNK_CELLS // (2 * min(2 * radius + 1, height)), 1)
+
+    for first in range(0, len(rows), chunk):
+        run_rows, run_first, run_last = _row_intervals(
+            rows[first:first + chunk], cols[first:first + chunk], size, radius, wraparound
+        )
+        np.add.at(flat, run_rows * (width + 1) + run_first, 1)
+        np.add.at(flat, run_rows * (width + 1) + run_last + 1, -1)
+
+    np.cumsum(stamps, axis=1, out=stamps)
+
+    return np.ascontiguousarray(stamps[:, :width])
+
+
+class CoverageIndex:
+    """
+    Number of centers within a fixed Manhattan radius of every cell of a fixed size grid, kept up to date as centers
+    are added and removed. Each change only touches the cells of one diamond, O(r^2), and the number of covered cells
+    is maintained along the way so reading it is O(1).
+
+    Centers are a set, like the positive entries of a grid, so a center can only be added once.
+    """
+
+    def __init__(self, size: T.Tuple[int, int], radius: int, wraparound: bool=False):
+        """
+        :param size: Pair giving the dimensions of the overall array.
+        :param radius: Manhattan radius of the neighborhood about each center.
+        :param wraparound: Wrap neighborhoods around the edges of the grid instead of clipping them.
+        """
+
+        if len(size) != 2:
+            raise ValueError("size must give the 2 dimensions of the grid")
+
+        if radius < 0:
+            raise ValueError("radius must not be negative")
+
+        self.size = (int(size[0]), int(size[1]))
+        self.radius = radius
+        self.wraparound = wraparound
+
+        self.coverage = np.zeros(self.size, dtype=np.int32)
+        self.centers = set()
+        self._count = 0
+
+    @classmethod
+    def from_array(cls, X: np.ndarray, radius: int, wraparound: bool=False) -> "CoverageIndex":
+        """
+        Build an index with every positive entry of `X` as a center, painting all of them at once.
+
+        :param X: 2D Numpy array of values. They can be any type as long as they can be compared greater than 0.
+        :param radius: Manhattan radius of the neighborhood about each center.
+        :param wraparound: Wrap neighborhoods around the edges of the grid instead of clipping them.
+        :return: The new index.
+        """
+
+        if len(X.shape) != 2:
+            raise ValueError("X must be a 2-dimensional array")
+
+        index = cls(X.shape, radius, wraparound)
+        rows, cols = (axis.astype(np.int64) for axis in np.nonzero(X > 0))
+
+        if len(rows) > 0:
+            index.coverage = _coverage_from_runs(rows, cols, index.size, radius, wraparound)
+            index.centers = set(zip(rows.tolist(), cols.tolist()))
+            index._count = int(np.count_nonzero(index.coverage))
+
+        return index
+
+    @property
+    def count(self) -> int:
+        # Number of cells within the radius of at least one center
+        return self._count
+
+    def add_center(self, row: int, col: int):
+        # Add a center, it must not be one already
+        center = self._check(row, col)
+
+        if center in self.centers:
+            raise ValueError(f"{center} is already a center")
+
+        self.centers.add(center)
+        self._paint(center, 1)
+
+    def remove_center(self, row: int, col: int):
+        # Remove an existing center
+        center = self._check(row, col)
+
+        if center not in self.centers:
+            raise ValueError(f"{center} is not a center")
+
+        self.centers.remove(center)
+        self._paint(center, -1)
+
+    def add_centers(self, rows: np.ndarray, cols: np.ndarray):
+        # Add many centers in one vectorized pass, none of them may be a center already
+        centers = self._check_many(rows, cols)
+
+        if not self.centers.isdisjoint(centers) or len(set(centers)) != len(centers):
+            raise ValueError("centers must be new and distinct")
+
+        self.centers.update(centers)
+        self._paint_many(rows, cols, 1)
+
+    def remove_centers(self, rows: np.ndarray, cols: np.ndarray):
+        # Remove many existing centers in one vectorized pass
+        centers = self._check_many(rows, cols)
+
+        if not self.centers.issuperset(centers) or len(set(centers)) != len(centers):
+            raise ValueError("centers must be existing and distinct")
+
+        self.centers.difference_update(centers)
+        self._paint_many(rows, cols, -1)
+
+    def _check_many(self, rows: np.ndarray, cols: np.ndarray) -> T.List[T.Tuple[int, int]]:
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+
+        if ((rows < 0) | (rows >= self.size[0]) | (cols < 0) | (cols >= self.size[1])).any():
+            raise ValueError("centers must lie within the grid")
+
+        return list(zip(rows.tolist(), cols.tolist()))
+
+    def _check(self, row: int, col: int) -> T.Tuple[int, int]:
+        row, col = int(row), int(col)
+
+        if not (0 <= row < self.size[0] and 0 <= col < self.size[1]):
+            raise ValueError(f"({row}, {col}) is not within the grid")
+
+        return row, col
+
+    def _paint(self, center: T.Tuple[int, int], delta: int):
+        # Add `delta` to the coverage of every cell of the diamond about `center` and keep the count in step. The runs
+        # never overlap, so each cell is hit once and a plain fancy index update is safe.
+        runs = _row_intervals(np.array([center[0]]), np.array([center[1]]), self.size, self.radius, self.wraparound)
+        cells = _expand_runs(*runs, self.size[1])
+
+        coverage = self.coverage.reshape(-1)
+        updated = coverage[cells] + delta
+        coverage[cells] = updated
+
+        # Cells going from 0 to 1 were just covered, cells going from 1 to 0 just uncovered
+        self._count += delta * int(np.count_nonzero(updated == (1 if delta > 0 else 0)))
+
+    def _paint_many(self, rows: np.ndarray, cols: np.ndarray, delta: int):
+        # Same as `_paint` for many centers at once. Their diamonds can overlap, so the update has to accumulate and
+        # the count is fixed up from the cells touched.
+        runs = _row_intervals(
+            np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64), self.size, self.radius, self.wraparound
+        )
+        cells = _expand_runs(*runs, self.size[1])
+        touched = np.unique(cells)
+
+        coverage = self.coverage.reshape(-1)
+        before = np.count_nonzero(coverage[touched])
+        np.add.at(coverage, cells, delta)
+
+        self._count += int(np.count_nonzero(coverage[touched])) - int(before)
+
+
+def update_coverage(previous: np.ndarray, current: np.ndarray, index: CoverageIndex) -> int:
+    """
+    Bring a `CoverageIndex` built for one frame of a time series of grids up to date with the next frame. Only the
+    cells whose positive/non-positive state changed between the frames are painted in or out. When so many cells
+    changed that painting their diamonds costs more than building from scratch, the index is rebuilt instead.
+
+    :param previous: 2D Numpy array the index currently reflects.
+    :param current: 2D Numpy array of the new frame, same shape.
+    :param index: Index for `previous`, updated in place.
+    :return: Integer count of the number of cells of `current` within the index radius of a positive entry.
+    """
+
+    if previous.shape != current.shape or tuple(current.shape) != index.size:
+        raise ValueError("frames must have the shape of the index")
+
+    was, now = previous > 0, current > 0
+
+    removed_rows, removed_cols = np.nonzero(was & ~now)
+    added_rows, added_cols = np.nonzero(now & ~was)
+
+    # Painting touches every cell of each changed diamond, rebuilding touches every cell of the grid once and stamps
+    # one run per row of each diamond of the new frame
+    height, width = index.size
+    diamond = min(2 * index.radius * (index.radius + 1) + 1, height * width)
+    paint_cost = (len(removed_rows) + len(added_rows)) * diamond
+    rebuild_cost = height * width + int(np.count_nonzero(now)) * min(2 * index.radius + 1, height)
+
+    if paint_cost > rebuild_cost:
+        rebuilt = CoverageIndex.from_array(current, index.radius, index.wraparound)
+        index.coverage, index.centers, index._count = rebuilt.coverage, rebuilt.centers, rebuilt._count
+    else:
+        if len(removed_rows) > 0:
+            index.remove_centers(removed_rows, removed_cols)
+        if len(added_rows) > 0:
+            index.add_centers(added_rows, added_cols)
+
+    return index.count
+
@@ -1,9 +1,92 @@
-import operator
+import json
+import os
+import warnings
 import numpy as np
-from functools import reduce
+from collections import OrderedDict
 
 import typing as T
 
+# Counting engines that work on the dense positive mask, and those that work on a list of center coordinates.
+MASK_ENGINES = ("sets", "dense", "packed", "distance")
+CENTER_ENGINES = ("intervals", "sweep", "imos")
+ENGINES = MASK_ENGINES + CENTER_ENGINES
+
+# Rough seconds per unit of work for each engine, see `_engine_work`, per interpreted step for all of them, see
+# `_engine_steps`, and per n log n unit for splitting off isolated centers, see `_count_auto`.
+_ENGINE_COSTS = {
+    "sets": 6e-9,
+    "dense": 2.3e-10,
+    "packed": 1.7e-9,
+    "distance": 1.1e-8,
+    "intervals": 3e-9,
+    "sweep": 3e-6,
+    "imos": 2e-9,
+    "step": 1e-6,
+    "isolation": 2.5e-8,
+}
+
+# Number of radii whose diamond stencils are cached, see `set_stencil_cache_size`.
+STENCIL_CACHE_SIZE = 32
+
+# Bytes per grid cell an engine may allocate, above a fixed allowance, before the dispatcher rules it out. Enough for
+# the dilation and the distance transform, which need a few bytes per cell, see `_engine_memory`.
+_ENGINE_MEMORY_PER_CELL = 8
+_ENGINE_MEMORY_ALLOWANCE = 2 ** 26
+
+# Cells enumerated at once by the set engine, see `_diamond_cells`.
+_ENUMERATE_CHUNK_CELLS = 2 ** 22
+
+# Interpreted steps taken by the pass that splits off isolated centers, and how many candidate pairs per center it may
+# check before giving up on a crowded grid, see `_count_auto`.
+_ISOLATION_STEPS = 60
+_ISOLATION_PAIRS_PER_CENTER = 16
+
+# Cells of a memory mapped grid held in memory at once while streaming it, see `_count_streamed`.
+_STREAM_BLOCK_CELLS = 2 ** 26
+
+# Where `python -m src.calibrate` stores costs measured on this machine, read once at import.
+ENGINE_COSTS_ENV = "CENTERSOLUTION_ENGINE_COSTS"
+DEFAULT_ENGINE_COSTS_PATH = os.path.join(os.path.expanduser("~"), ".config", "centerSolution", "engine_costs.json")
+
+
+def engine_costs_path() -> str:
+    # Calibration file location, the environment variable wins over the default
+    return os.environ.get(ENGINE_COSTS_ENV, DEFAULT_ENGINE_COSTS_PATH)
+
+
+def load_engine_costs(path: T.Optional[str]=None) -> T.Dict[str, float]:
+    """
+    Load calibrated engine costs into the dispatcher. Engines missing from the file keep their current cost. A missing
+    file is not an error, a malformed one only warns, so a bad calibration can never stop counting from working.
+
+    :param path: JSON file written by `src.calibrate`, defaults to `engine_costs_path()`.
+    :return: The engine costs now in use.
+    """
+
+    path = engine_costs_path() if path is None else path
+
+    if not os.path.exists(path):
+        return dict(_ENGINE_COSTS)
+
+    try:
+        with open(path) as f:
+            costs = json.load(f)["engine_costs"]
+
+        costs = {method: float(cost) for method, cost in costs.items() if method in _ENGINE_COSTS}
+        if not all(np.isfinite(cost) and cost > 0 for cost in costs.values()):
+            raise ValueError("costs must be positive")
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        warnings.warn(f"Ignoring malformed engine costs in {path}: {e}")
+        return dict(_ENGINE_COSTS)
+
+    _ENGINE_COSTS.update(costs)
+
+    return dict(_ENGINE_COSTS)
+
+
+load_engine_costs()
+
+
 def array_to_pos_center_coordinates(X: np.ndarray) -> T.List[T.Tuple[int, int]]:
     # Helper that extracts the positive center coordinates from a numpy array
     coordinates_nonzero = np.nonzero(X > 0)
@@ -12,6 +95,75 @@ def array_to_pos_center_coordinates(X: np.ndarray) -> T.List[T.Tuple[int, int]]:
     return zip(*coordinates_nonzero)
 
 
+class _StencilCache:
+    """
+    Bounded least recently used cache of diamond stencils, the (k, 2) array of (d_x, d_y) offsets of every cell within
+    a Manhattan radius of the origin. Stencils are the same for every center, so they are built once per radius and
+    shared, read only.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._stencils = OrderedDict()
+
+    def get(self, radius: int) -> np.ndarray:
+        stencil = self._stencils.get(radius)
+
+        if stencil is None:
+            stencil = self._build(radius)
+            self._stencils[radius] = stencil
+            self.resize(self.maxsize)
+        else:
+            self._stencils.move_to_end(radius)
+
+        return stencil
+
+    def resize(self, maxsize: int):
+        # Change the bound, evicting the least recently used stencils if needed
+        if maxsize < 0:
+            raise ValueError("maxsize must not be negative")
+
+        self.maxsize = maxsize
+        while len(self._stencils) > maxsize:
+            self._stencils.popitem(last=False)
+
+    @staticmethod
+    def _build(radius: int) -> np.ndarray:
+        span = np.arange(-radius, radius + 1)
+        d_x, d_y = np.meshgrid(span, span, indexing="ij")
+        inside = np.abs(d_x) + np.abs(d_y) <= radius
+
+        stencil = np.stack([d_x[inside], d_y[inside]], axis=1).astype(np.int64)
+        stencil.setflags(write=False)
+
+        return stencil
+
+
+_stencils = _StencilCache(maxsize=STENCIL_CACHE_SIZE)
+
+
+def diamond_offsets(radius: int) -> np.ndarray:
+    """
+    All (d_x, d_y) offsets within a given Manhattan radius of the origin, including the origin itself. Results are
+    cached, see `set_stencil_cache_size`, and must not be modified.
+
+    :param radius: Manhattan radius of the neighborhood.
+    :return: Read only int64 array of shape (k, 2), with k = 2 * radius * (radius + 1) + 1.
+    """
+
+    return _stencils.get(radius)
+
+
+def set_stencil_cache_size(maxsize: int):
+    """
+    Set how many radii `diamond_offsets` keeps stencils for.
+
+    :param maxsize: Number of stencils to keep, least recently used ones are evicted first.
+    """
+
+    _stencils.resize(maxsize)
+
+
 def manhattan_neighborhood(
     coor: T.Tuple[int, int],
     radius: int,
@@ -34,39 +186,1197 @@ def manhattan_neighborhood(
     :return: Set of all coordinates around the center point within the given Manhattan/L1 radius.
     """
 
-    x, y = coor
-
-    # We use a Set to automatically discard repeats. Later we can also naturally union the neighborhood around each
-    # center to automatically get a list of unique cells.
-    neighborhood = set()
-
-    # Scan the L-infinity neighborhood of the center and add points that fall within the given radius.
-    # We only need to scan the upper right quadrant and then add the other 3 points using symmetry. Set will handle
-    # overlap.
-    for d_x in range(0, radius + 1):
-        for d_y in range(0, radius + 1):
-            if radius >= d_x + d_y > 0:  # > 0 excludes center
-                neighborhood.update(
-                    [
-                        (x + d_x, y + d_y),
-                        (x - d_x, y + d_y),
-                        (x + d_x, y - d_y),
-                        (x - d_x, y - d_y),
-                    ]
-                )
-
-    # Some cells in neighborhoods may be off the edges of the array. Per the problem statement we want to ignore those.
+    x, y = (int(c) for c in coor)
+
     if prune_wraparound:
-        # Bounds subtract 1 because of zero indexing
-        x_max, y_max = size[0] - 1, size[1] - 1
-        return {
-            (x, y) for (x, y) in neighborhood if (0 <= x <= x_max) & (0 <= y <= y_max)
-        }
+        # Only walk the rows of the diamond that are on the grid, and clip each row's run of columns to the grid, so the
+        # work is bounded by the grid size however large the radius is.
+        d_x = np.arange(max(-radius, -x), min(radius, size[0] - 1 - x) + 1)
+        half_width = radius - np.abs(d_x)
+        first = np.maximum(y - half_width, 0)
+        last = np.minimum(y + half_width, size[1] - 1)
+
+        lengths = np.maximum(last - first + 1, 0)
+        run_starts = np.cumsum(lengths) - lengths
+        neighborhood = np.stack([
+            np.repeat(x + d_x, lengths),
+            np.repeat(first - run_starts, lengths) + np.arange(lengths.sum()),
+        ], axis=1)
+    else:
+        # The diamond is the same around every center, so shift the cached stencil instead of scanning for it
+        neighborhood = diamond_offsets(radius) + np.array([x, y], dtype=np.int64)
+
+    # We still return a Set so neighborhoods of different centers union naturally into a list of unique cells. By design
+    # the center itself is not part of its neighborhood.
+    neighborhood = set(map(tuple, neighborhood.tolist()))
+    neighborhood.discard((x, y))
+
+    return neighborhood
+
+
+def _diamond_cells(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    size: T.Tuple[int, int],
+    radius: int,
+    wraparound: bool=False
+) -> T.Iterator[np.ndarray]:
+    """
+    Enumerate every cell of the diamond about each center as linear indices row * W + col, by broadcasting the centers
+    against the cached stencil, or for diamonds cut by the grid edges from their clipped row intervals. Centers go in
+    chunks of about `_ENUMERATE_CHUNK_CELLS` cells so memory stays bounded. Cells shared by several diamonds are
+    repeated.
+
+    :param rows: Integer array of center rows.
+    :param cols: Integer array of center columns.
+    :param size: Pair giving the dimensions of the overall array.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param wraparound: Wrap neighborhoods around the edges of the grid instead of clipping them.
+    :return: Iterator of int64 arrays of linear cell indices, one per chunk of centers.
+    """
+
+    height, width = size
+    diamond = 2 * radius * (radius + 1) + 1
+
+    # Diamonds that stay inside the grid, or with wraparound do not reach around onto themselves, are the stencil
+    # shifted onto the center. The others are built row interval by row interval already clipped (or wrapped) to the
+    # grid, so a center never costs more than min(diamond, H * W) cells however large the radius is.
+    if wraparound:
+        clipped = np.full(len(rows), 2 * radius + 1 > min(height, width))
+    else:
+        clipped = (rows < radius) | (rows >= height - radius) | (cols < radius) | (cols >= width - radius)
+
+    inner_rows, inner_cols = rows[~clipped], cols[~clipped]
+    if len(inner_rows):
+        stencil = diamond_offsets(radius)
+        chunk = max(_ENUMERATE_CHUNK_CELLS // diamond, 1)
+
+        for first in range(0, len(inner_rows), chunk):
+            cell_rows = inner_rows[first:first + chunk, None] + stencil[None, :, 0]
+            cell_cols = inner_cols[first:first + chunk, None] + stencil[None, :, 1]
+
+            if wraparound:
+                cell_rows, cell_cols = cell_rows % height, cell_cols % width
+
+            yield (cell_rows * width + cell_cols).ravel()
+
+    edge_rows, edge_cols = rows[clipped], cols[clipped]
+    chunk = max(_ENUMERATE_CHUNK_CELLS // min(diamond, height * width), 1)
+
+    for first in range(0, len(edge_rows), chunk):
+        runs = _row_intervals(edge_rows[first:first + chunk], edge_cols[first:first + chunk], size, radius, wraparound)
+        yield _expand_runs(*runs, width)
+
+
+def _count_sets(X: np.ndarray, radius: int, wraparound: bool=False) -> int:
+    # Original enumerate-then-dedupe algorithm: list every cell of every diamond and count the unique ones. Cells are
+    # linear indices deduplicated by scattering into a mask, rather than tuples in a Set.
+    rows, cols = (axis.astype(np.int64) for axis in np.nonzero(X > 0))
+
+    seen = np.zeros(X.size, dtype=bool)
+    for cells in _diamond_cells(rows, cols, X.shape, radius, wraparound):
+        seen[cells] = True
+
+    return int(np.count_nonzero(seen))
+
+
+def _row_offset_groups(height: int, radius: int, wraparound: bool=False) -> T.Dict[int, T.List[int]]:
+    """
+    Split an L1 diamond into its rows. Maps each horizontal half width to the row offsets whose slice of the diamond has
+    that half width, so callers can reuse one horizontal dilation for both the row above and below the center.
+
+    Offsets that can never land on the grid are dropped. With wraparound, offsets that land on the same row modulo
+    `height` are merged and only the widest slice is kept.
+    """
+
+    groups = {}
+
+    if wraparound and 2 * radius + 1 >= height:
+        # Diamond wraps onto itself vertically, one offset per row residue using the shortest way around the torus.
+        offsets = [(d_x, radius - min(d_x, height - d_x)) for d_x in range(height)]
+    else:
+        reach = radius if wraparound else min(radius, height - 1)
+        offsets = [(d_x, radius - abs(d_x)) for d_x in range(-reach, reach + 1)]
+
+    for d_x, half_width in offsets:
+        groups.setdefault(half_width, []).append(d_x)
+
+    return groups
+
+
+def _or_shifted_rows(out: np.ndarray, rows: np.ndarray, d_x: int, wraparound: bool=False):
+    # out[..., i + d_x, :] |= rows[..., i, :] for every row i, either dropping or wrapping rows that fall off the grid.
+    height = out.shape[-2]
+
+    if wraparound:
+        d_x %= height
+        out[..., d_x:, :] |= rows[..., :height - d_x, :]
+        out[..., :d_x, :] |= rows[..., height - d_x:, :]
+    elif d_x >= 0:
+        out[..., d_x:, :] |= rows[..., :height - d_x, :]
+    else:
+        out[..., :height + d_x, :] |= rows[..., -d_x:, :]
+
+
+def _dilate_dense(mask: np.ndarray, radius: int, wraparound: bool=False) -> np.ndarray:
+    """
+    Dilate a boolean mask by an L1 diamond of the given radius.
+
+    Each row of the diamond is a horizontal run, so the dilation is the OR of the mask dilated horizontally by
+    `radius - |d_x|` and shifted by `d_x` rows. Horizontal dilations are window sums over a single cumulative sum, which
+    makes the total cost O(H * W * radius) regardless of how many cells are positive.
+
+    Cells are indexed on the last two axes, so a stack of masks is dilated in one go.
+
+    :param mask: Boolean array of positive cells, the last two axes are the grid.
+    :param radius: Manhattan radius of the dilation.
+    :param wraparound: Wrap the diamond around the edges of the grid instead of clipping it.
+    :return: Boolean array of the same shape, true for every cell within `radius` of a true cell of `mask`.
+    """
+
+    height, width = mask.shape[-2:]
+
+    # Pad once by the widest run that can matter, any wider window covers the whole row anyway.
+    pad = min(radius, width if wraparound else width - 1)
+    padding = ((0, 0),) * (mask.ndim - 1) + ((pad, pad),)
+    padded = np.pad(mask, padding, mode="wrap" if wraparound else "constant")
+
+    running = np.zeros(mask.shape[:-1] + (width + 2 * pad + 1,), dtype=np.int32)
+    np.cumsum(padded, axis=-1, dtype=np.int32, out=running[..., 1:])
+
+    out = np.zeros_like(mask, dtype=bool)
+
+    for half_width, offsets in _row_offset_groups(height, radius, wraparound).items():
+        if wraparound and 2 * half_width + 1 >= width:
+            runs = np.repeat(mask.any(axis=-1, keepdims=True), width, axis=-1)
+        else:
+            # Window [j - half_width, j + half_width] of the original columns, shifted by the padding
+            half_width = min(half_width, pad)
+            after = running[..., pad + half_width + 1:pad + half_width + 1 + width]
+            runs = after > running[..., pad - half_width:pad - half_width + width]
+
+        for d_x in offsets:
+            _or_shifted_rows(out, runs, d_x, wraparound)
+
+    return out
+
+
+def _popcount(words: np.ndarray) -> int:
+    # Total number of set bits, np.bitwise_count only exists from numpy 2.0 on
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(words).sum(dtype=np.int64))
+
+    return int(np.unpackbits(words.view(np.uint8)).sum(dtype=np.int64))
+
+
+def _pack_rows(mask: np.ndarray) -> np.ndarray:
+    # Pack each row of a boolean array into uint64 words, column 64 * w + b is bit b of word w
+    height, width = mask.shape
+
+    padded = np.zeros((height, -(-width // 64) * 64), dtype=bool)
+    padded[:, :width] = mask
+
+    return np.packbits(padded, axis=1, bitorder="little").view("<u8")
+
+
+def _shift_columns(words: np.ndarray, shift: int) -> np.ndarray:
+    # Move every bit of packed rows `shift` columns to the right (negative is left), bits pushed off either end are lost
+    n_words = words.shape[1]
+    word_shift, bit_shift = divmod(abs(shift), 64)
+
+    out = np.zeros_like(words)
+
+    if word_shift >= n_words:
+        return out
+
+    carry = np.uint64(64 - bit_shift)
+    bit_shift = np.uint64(bit_shift)
+
+    if shift >= 0:
+        source = words[:, :n_words - word_shift]
+        out[:, word_shift:] = source << bit_shift
+        if bit_shift:
+            out[:, word_shift + 1:] |= source[:, :-1] >> carry
+    else:
+        source = words[:, word_shift:]
+        out[:, :n_words - word_shift] = source >> bit_shift
+        if bit_shift:
+            out[:, :n_words - word_shift - 1] |= source[:, 1:] << carry
+
+    return out
+
+
+def _dilate_packed_columns(words: np.ndarray, half_width: int) -> np.ndarray:
+    # OR of packed rows shifted by every offset in [-half_width, half_width]. Each direction doubles the covered span
+    # per step, so it takes O(log half_width) word-level passes.
+    out = words.copy()
+
+    for direction in (1, -1):
+        acc, span = words, 1
+        while span <= half_width:
+            step = min(span, half_width + 1 - span)
+            acc = acc | _shift_columns(acc, direction * step)
+            span += step
+        out |= acc
+
+    return out
+
+
+def _count_packed(mask: np.ndarray, radius: int, wraparound: bool=False) -> int:
+    """
+    Count the cells within `radius` of a true cell of `mask` using bitset rows.
+
+    Same row-by-row decomposition as `_dilate_dense`, but every row is packed into uint64 words so each horizontal
+    dilation is a handful of word shifts and ORs over 1/64th of the data, and the final count is a popcount.
+
+    :param mask: 2D boolean array of positive cells.
+    :param radius: Manhattan radius of the neighborhood about each positive cell.
+    :param wraparound: Wrap the diamond around the edges of the grid instead of clipping it.
+    :return: Number of cells within `radius` of at least one positive cell.
+    """
+
+    height, width = mask.shape
+
+    # With wraparound the columns are padded with copies from the other side so plain shifts see across the seam,
+    # without it bits simply fall off the ends. Either way only columns [pad, pad + width) are counted at the end.
+    pad = min(radius, width) if wraparound else 0
+    words = _pack_rows(np.pad(mask, ((0, 0), (pad, pad)), mode="wrap"))
+
+    columns = np.zeros((1, width + 2 * pad), dtype=bool)
+    columns[:, pad:pad + width] = True
+    columns = _pack_rows(columns)
+
+    out = np.zeros_like(words)
+
+    for half_width, offsets in _row_offset_groups(height, radius, wraparound).items():
+        if wraparound and 2 * half_width + 1 >= width:
+            runs = np.where(mask.any(axis=1, keepdims=True), columns, np.uint64(0))
+        else:
+            runs = _dilate_packed_columns(words, min(half_width, width - 1))
+
+        for d_x in offsets:
+            _or_shifted_rows(out, runs, d_x, wraparound)
+
+    return _popcount(out & columns)
+
+
+def _l1_sweep(dist: np.ndarray, axis: int, wraparound: bool=False):
+    # In place forward then backward pass of dist[i] = min(dist[i], dist[i -/+ 1] + 1) along one axis. With wraparound
+    # each pass is run a second time starting from the far end so distances also propagate across the seam.
+    lines = np.moveaxis(dist, axis, 0)
+    length = lines.shape[0]
+
+    for _ in range(2 if wraparound else 1):
+        if wraparound:
+            np.minimum(lines[0], lines[-1] + 1, out=lines[0])
+        for i in range(1, length):
+            np.minimum(lines[i], lines[i - 1] + 1, out=lines[i])
+
+    for _ in range(2 if wraparound else 1):
+        if wraparound:
+            np.minimum(lines[-1], lines[0] + 1, out=lines[-1])
+        for i in range(length - 2, -1, -1):
+            np.minimum(lines[i], lines[i + 1] + 1, out=lines[i])
+
+
+def _distance_transform(mask: np.ndarray, wraparound: bool=False) -> np.ndarray:
+    """
+    Two-pass L1 (city block) distance transform of a boolean mask.
+
+    L1 distance is separable, so a forward and a backward pass along the rows followed by the same along the columns
+    give the exact distance from every cell to the nearest true cell. Each pass is a loop over one axis with the other
+    axis vectorized, for a total cost of O(H * W) independent of any radius.
+
+    Cells are indexed on the last two axes, so a stack of masks is transformed in one go.
+
+    :param mask: Boolean array of positive cells, the last two axes are the grid.
+    :param wraparound: Measure distances on the torus instead of the bounded grid.
+    :return: int32 array of distances. Grids with no true cell are filled with `H + W`, which is larger than any real
+     distance.
+    """
+
+    height, width = mask.shape[-2:]
+
+    dist = np.where(mask, 0, height + width).astype(np.int32)
+
+    _l1_sweep(dist, dist.ndim - 2, wraparound)
+
+    # Sweeping along the last axis directly steps through strided columns, a transposed copy keeps every step contiguous
+    columns = np.ascontiguousarray(np.moveaxis(dist, -1, 0))
+    _l1_sweep(columns, 0, wraparound)
+    dist[...] = np.moveaxis(columns, 0, -1)
+
+    return dist
+
+
+def _torus_translates(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    size: T.Tuple[int, int],
+    radius: int
+) -> T.Tuple[np.ndarray, np.ndarray]:
+    # Copies of each center shifted by whole grid periods, enough that clipping the union of their diamonds to the grid
+    # gives the wrapped neighborhood. Only copies that can reach back into the grid are needed.
+    height, width = size
+
+    row_reps, col_reps = -(-radius // height), -(-radius // width)
+    row_shifts = np.arange(-row_reps, row_reps + 1) * height
+    col_shifts = np.arange(-col_reps, col_reps + 1) * width
+
+    rows = rows[:, None, None] + row_shifts[None, :, None] + 0 * col_shifts[None, None, :]
+    cols = cols[:, None, None] + col_shifts[None, None, :] + 0 * row_shifts[None, :, None]
+
+    return rows.ravel(), cols.ravel()
+
+
+def _row_intervals(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    size: T.Tuple[int, int],
+    radius: int,
+    wraparound: bool=False
+) -> T.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Cut the diamond around each center into one run of cells per grid row. Runs are clipped to the grid, or with
+    wraparound taken modulo the grid size, in which case a run crossing the left/right edge is split in two.
+
+    :param rows: Integer array of center rows.
+    :param cols: Integer array of center columns.
+    :param size: Pair giving the dimensions of the overall array.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param wraparound: Wrap neighborhoods around the edges of the grid instead of clipping them.
+    :return: Arrays (row, first, last) with one entry per run, `first` and `last` are inclusive columns.
+    """
+
+    height, width = size
+
+    offsets = [
+        (d_x, half_width)
+        for half_width, row_offsets in _row_offset_groups(height, radius, wraparound).items()
+        for d_x in row_offsets
+    ]
+    d_x, half_width = (np.array(column, dtype=np.int64) for column in zip(*offsets))
+
+    run_rows = (rows[:, None] + d_x[None, :]).ravel()
+    first = (cols[:, None] - half_width[None, :]).ravel()
+    last = (cols[:, None] + half_width[None, :]).ravel()
+
+    if not wraparound:
+        keep = (0 <= run_rows) & (run_rows < height)
+        return run_rows[keep], np.maximum(first[keep], 0), np.minimum(last[keep], width - 1)
+
+    run_rows %= height
+
+    full = last - first + 1 >= width
+    first[full], last[full] = 0, width - 1
+
+    # Pieces hanging off either side come back in on the opposite side
+    low, high = first < 0, last >= width
+
+    low_rows, high_rows = run_rows[low], run_rows[high]
+    low_first, high_last = first[low] + width, last[high] - width
+
+    return (
+        np.concatenate([run_rows, low_rows, high_rows]),
+        np.concatenate([np.maximum(first, 0), low_first, np.zeros(len(high_rows), dtype=np.int64)]),
+        np.concatenate([np.minimum(last, width - 1), np.full(len(low_rows), width - 1, dtype=np.int64), high_last]),
+    )
+
+
+def _expand_runs(run_rows: np.ndarray, first: np.ndarray, last: np.ndarray, width: int) -> np.ndarray:
+    # Linear indices row * width + col of every cell of the runs from `_row_intervals`, in order
+    lengths = last - first + 1
+    run_starts = np.cumsum(lengths) - lengths
+
+    return np.repeat(run_rows * width + first - run_starts, lengths) + np.arange(lengths.sum())
+
+
+def _count_intervals(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    size: T.Tuple[int, int],
+    radius: int,
+    wraparound: bool=False
+) -> int:
+    """
+    Count the cells within a Manhattan radius of a list of centers by merging per-row runs.
+
+    Every diamond crosses each row in a single run, see `_row_intervals`. Laying the rows end to end with a one cell gap
+    turns the union of all runs into a one dimensional interval union, done with a sort and a running maximum of the run
+    ends. Individual cells are never enumerated, cost is O(n r log(n r)).
+
+    :param rows: Integer array of center rows.
+    :param cols: Integer array of center columns.
+    :param size: Pair giving the dimensions of the overall array.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param wraparound: Wrap neighborhoods around the edges of the grid instead of clipping them.
+    :return: Number of cells within `radius` of at least one center.
+    """
+
+    width = size[1]
+    run_rows, first, last = _row_intervals(rows, cols, size, radius, wraparound)
+
+    if len(run_rows) == 0:
+        return 0
+
+    first, last = run_rows * (width + 1) + first, run_rows * (width + 1) + last
+
+    order = np.argsort(first, kind="stable")
+    first, last = first[order], last[order]
+
+    # Everything up to the furthest end seen so far is already counted
+    reached = np.empty_like(last)
+    reached[0] = first[0] - 1
+    np.maximum.accumulate(last[:-1], out=reached[1:])
+    np.maximum(reached[1:], first[0] - 1, out=reached[1:])
+
+    return int(np.maximum(last - np.maximum(first, reached + 1) + 1, 0).sum())
+
+
+def _coverage_imos(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    size: T.Tuple[int, int],
+    radius: int,
+    wraparound: bool=False
+) -> np.ndarray:
+    """
+    Number of centers within a Manhattan radius of every cell, by difference-array (imos) painting.
+
+    In coordinates u = row + col, v = row - col + W - 1 each diamond is an axis aligned square, so it is painted by
+    stamping +1/-1 on its four corners of a difference array over the rotated bounding box. Two cumulative sums turn the
+    stamps into per-cell coverage, which is then read back at the grid cells. Cost is O((H + W)^2 + n), independent of
+    the radius.
+
+    :param rows: Integer array of center rows.
+    :param cols: Integer array of center columns.
+    :param size: Pair giving the dimensions of the overall array.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param wraparound: Wrap neighborhoods around the edges of the grid instead of clipping them.
+    :return: int32 array of shape `size` with the number of diamonds covering each cell.
+    """
+
+    height, width = size
+    extent = height + width - 1
+
+    if wraparound:
+        rows, cols = _torus_translates(rows, cols, size, radius)
+
+    u, v = rows + cols, rows - cols + width - 1
+    u_lo, u_hi = np.maximum(u - radius, 0), np.minimum(u + radius, extent - 1) + 1
+    v_lo, v_hi = np.maximum(v - radius, 0), np.minimum(v + radius, extent - 1) + 1
+
+    keep = (u_lo < u_hi) & (v_lo < v_hi)
+    u_lo, u_hi, v_lo, v_hi = u_lo[keep], u_hi[keep], v_lo[keep], v_hi[keep]
+
+    corners = np.concatenate([u_lo, u_lo, u_hi, u_hi]) * (extent + 1) + np.concatenate([v_lo, v_hi, v_lo, v_hi])
+    signs = np.repeat(np.array([1, -1, -1, 1], dtype=np.int32), len(u_lo))
+
+    stamps = np.zeros((extent + 1, extent + 1), dtype=np.int32)
+    np.add.at(stamps.ravel(), corners, signs)
+
+    np.cumsum(stamps, axis=0, out=stamps)
+    np.cumsum(stamps, axis=1, out=stamps)
+
+    # Grid cell (i, j) sits at u = i + j, v = i - j + W - 1, so moving along a grid row steps the flat index by `extent`
+    # and moving down a row steps it by `extent + 2`. That makes the grid a strided view of the rotated box.
+    itemsize = stamps.itemsize
+    coverage = np.lib.stride_tricks.as_strided(
+        stamps.ravel()[width - 1:],
+        shape=(height, width),
+        strides=((extent + 2) * itemsize, extent * itemsize),
+        writeable=False,
+    )
+
+    return coverage.copy()
+
+
+def _range_sum(start: int, stop: int) -> int:
+    # Sum of the integers in [start, stop)
+    return (start + stop - 1) * (stop - start) // 2
+
+
+class _CoverageTree:
+    """
+    Segment tree for Klee's measure problem in one dimension. Intervals of integers are added and removed and the tree
+    tracks how many integers are covered by at least one interval, along with the sum of those integers, over any query
+    range.
+
+    Coordinates are compressed to `bounds`, elementary segment `k` holds the integers in `[bounds[k], bounds[k + 1])`.
+    """
+
+    def __init__(self, bounds: T.Sequence[int]):
+        self.bounds = [int(b) for b in bounds]
+        self.size = len(self.bounds) - 1
+
+        self.cover = [0] * (4 * self.size)
+        self.length = [0] * (4 * self.size)
+        self.total = [0] * (4 * self.size)
+
+    def update(self, start: int, stop: int, delta: int):
+        # Add `delta` to the cover count of elementary segments [start, stop)
+        self._update(1, 0, self.size, start, stop, delta)
+
+    def _update(self, node: int, lo: int, hi: int, start: int, stop: int, delta: int):
+        if stop <= lo or hi <= start:
+            return
+
+        if start <= lo and hi <= stop:
+            self.cover[node] += delta
+        else:
+            mid = (lo + hi) // 2
+            self._update(2 * node, lo, mid, start, stop, delta)
+            self._update(2 * node + 1, mid, hi, start, stop, delta)
+
+        if self.cover[node] > 0:
+            self.length[node] = self.bounds[hi] - self.bounds[lo]
+            self.total[node] = _range_sum(self.bounds[lo], self.bounds[hi])
+        elif hi - lo == 1:
+            self.length[node] = self.total[node] = 0
+        else:
+            self.length[node] = self.length[2 * node] + self.length[2 * node + 1]
+            self.total[node] = self.total[2 * node] + self.total[2 * node + 1]
+
+    @property
+    def covered(self) -> int:
+        return self.length[1]
+
+    def query(self, first: int, last: int) -> T.Tuple[int, int]:
+        # Number and sum of the covered integers in [first, last]
+        if first > last:
+            return 0, 0
+
+        return self._query(1, 0, self.size, first, last)
+
+    def _query(self, node: int, lo: int, hi: int, first: int, last: int) -> T.Tuple[int, int]:
+        node_first, node_last = self.bounds[lo], self.bounds[hi] - 1
+
+        if last < node_first or node_last < first or self.length[node] == 0:
+            return 0, 0
+
+        if first <= node_first and node_last <= last:
+            return self.length[node], self.total[node]
 
+        if self.cover[node] > 0:
+            first, last = max(first, node_first), min(last, node_last)
+            return last - first + 1, _range_sum(first, last + 1)
+
+        mid = (lo + hi) // 2
+        left_length, left_total = self._query(2 * node, lo, mid, first, last)
+        right_length, right_total = self._query(2 * node + 1, mid, hi, first, last)
+
+        return left_length + right_length, left_total + right_total
+
+    def prefix_sum(self, first: int, last: int) -> int:
+        # Sum over x in [first, last] of the number of covered integers <= x
+        if first > last:
+            return 0
+
+        before, _ = self.query(self.bounds[0], first - 1)
+        inside, inside_total = self.query(first, last)
+
+        # Integers covered before `first` count once for every x, covered c inside the range count for x in [c, last]
+        return before * (last - first + 1) + inside * (last + 1) - inside_total
+
+
+def _count_sweep_parity(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    size: T.Tuple[int, int],
+    radius: int,
+    parity: int
+) -> int:
+    # Sweep-line count of the cells with (row + col) % 2 == parity, see `_count_sweep`.
+    height, width = size
+
+    # Rotated lattice coordinates, cell (i, j) is (s, t) with i + j = 2s + parity and i - j = 2t + parity
+    u, v = rows + cols, rows - cols
+    s_lo, s_hi = -((parity + radius - u) // 2), (u + radius - parity) // 2
+    t_lo, t_hi = -((parity + radius - v) // 2), (v + radius - parity) // 2
+
+    # Every anti-diagonal i + j in [0, H + W - 2] holds at least one cell, so these are exactly the s with cells
+    s_max = (height + width - 2 - parity) // 2
+    s_lo, s_hi = np.maximum(s_lo, 0), np.minimum(s_hi, s_max)
+
+    keep = (s_lo <= s_hi) & (t_lo <= t_hi)
+    s_lo, s_hi, t_lo, t_hi = s_lo[keep], s_hi[keep], t_lo[keep], t_hi[keep]
+
+    if len(s_lo) == 0:
+        return 0
+
+    bounds = np.unique(np.concatenate([t_lo, t_hi + 1]))
+    starts, stops = np.searchsorted(bounds, t_lo), np.searchsorted(bounds, t_hi + 1)
+
+    event_s = np.concatenate([s_lo, s_hi + 1])
+    event_delta = np.concatenate([np.ones_like(s_lo), -np.ones_like(s_lo)])
+    event_start, event_stop = np.concatenate([starts, starts]), np.concatenate([stops, stops])
+    order = np.argsort(event_s, kind="stable")
+
+    events = zip(
+        event_s[order].tolist(), event_delta[order].tolist(), event_start[order].tolist(), event_stop[order].tolist()
+    )
+
+    # Within the grid, t runs over [L(s), R(s)]. Both ends are piecewise linear in s with one kink each, where the
+    # binding edge switches from the top/left edge of the grid to the bottom/right.
+    kink_left, kink_right = (width - 1 - parity) // 2 + 1, (height - 1 - parity) // 2 + 1
+
+    def left(s):
+        return -s - parity if s < kink_left else s - width + 1
+
+    def right(s):
+        return s if s < kink_right else height - 1 - s - parity
+
+    stops_s = sorted(set(event_s.tolist()) | {kink_left, kink_right, s_max + 1})
+    stops_s = [s for s in stops_s if 0 <= s <= s_max + 1]
+
+    tree = _CoverageTree(bounds)
+    count = 0
+
+    pending = next(events, None)
+    for s_first, s_next in zip(stops_s[:-1], stops_s[1:]):
+        while pending is not None and pending[0] <= s_first:
+            _, delta, start, stop = pending
+            tree.update(start, stop, delta)
+            pending = next(events, None)
+
+        if tree.covered == 0:
+            continue
+
+        # Coverage is fixed for s in [s_first, s_next) and each end of the window moves by one per step, so the ends
+        # sweep contiguous ranges of t and the sum over s becomes a sum of prefix counts.
+        s_last = s_next - 1
+        right_ends = sorted((right(s_first), right(s_last)))
+        left_ends = sorted((left(s_first) - 1, left(s_last) - 1))
+
+        count += tree.prefix_sum(*right_ends) - tree.prefix_sum(*left_ends)
+
+    return count
+
+
+def _count_sweep(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    size: T.Tuple[int, int],
+    radius: int,
+    wraparound: bool=False
+) -> int:
+    """
+    Count the cells of a grid within a Manhattan radius of a list of centers with a sweep line, without touching the
+    grid itself.
+
+    Under u = row + col, v = row - col every L1 diamond becomes an axis aligned square, restricted to the cells whose u
+    has the same parity as v. Splitting the cells by parity turns each square into a plain rectangle of integer points,
+    and the area of a union of rectangles is found with a sweep over one axis and a segment tree over the other (Klee's
+    measure). The grid bounds become a window on the tree that moves linearly with the sweep, which is summed in closed
+    form between events. Cost is O(n log n) in the number of centers, independent of the radius and the grid area.
+
+    :param rows: Integer array of center rows.
+    :param cols: Integer array of center columns.
+    :param size: Pair giving the dimensions of the overall array.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param wraparound: Wrap neighborhoods around the edges of the grid instead of clipping them.
+    :return: Number of cells within `radius` of at least one center.
+    """
+
+    rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+
+    if wraparound:
+        rows, cols = _torus_translates(rows, cols, size, radius)
+
+    return sum(_count_sweep_parity(rows, cols, size, radius, parity) for parity in (0, 1))
+
+
+def _clipped_diamond_area(rows: np.ndarray, cols: np.ndarray, size: T.Tuple[int, int], radius: int) -> np.ndarray:
+    """
+    Number of cells of the grid within a Manhattan radius of each center, with the diamond clipped at the grid edges,
+    in O(1) per center.
+
+    The full diamond has 2r(r + 1) + 1 cells. Past an edge at distance e from the center lies a smaller diamond corner
+    of (r - e)^2 cells, which is taken off for each edge. Where two adjacent edges both cut the diamond, the cells past
+    both were taken off twice and a triangle of T(m) = (m + 1)(m + 2) / 2 cells with m = r - e1 - e2 - 2 is added back.
+    Opposite edges never cut the same cells, the center is between them.
+
+    :param rows: Integer array of center rows.
+    :param cols: Integer array of center columns.
+    :param size: Pair giving the dimensions of the overall array.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :return: Integer array with the in-bounds area of each center's diamond.
+    """
+
+    height, width = size
+    rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+
+    # Distances to the top, left, bottom and right edge, in order around the grid so neighbors are adjacent edges
+    edges = [rows, cols, height - 1 - rows, width - 1 - cols]
+
+    area = np.full(len(rows), 2 * radius * (radius + 1) + 1, dtype=np.int64)
+
+    for e in edges:
+        area -= np.maximum(radius - e, 0) ** 2
+
+    for e1, e2 in zip(edges, edges[1:] + edges[:1]):
+        m = np.maximum(radius - e1 - e2 - 1, 0)
+        area += m * (m + 1) // 2
+
+    return area
+
+
+def _overlap_pairs(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    radius: int,
+    max_pairs: T.Optional[int]=None
+) -> T.Optional[T.Tuple[np.ndarray, np.ndarray]]:
+    """
+    Find every pair of centers whose diamonds share a cell, i.e. that are within 2 * radius of each other (clipping
+    at the grid edges is ignored).
+
+    Centers are hashed into square buckets 2 * radius + 1 cells wide, so a center can only be close to centers in its
+    own and the 8 neighboring buckets. Candidate pairs from each pair of neighboring buckets are listed all at once and
+    then filtered by distance, which is cheap for well separated centers but quadratic for crowded buckets.
+
+    :param rows: Integer array of center rows.
+    :param cols: Integer array of center columns.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param max_pairs: Give up once more candidate pairs than this would have to be checked.
+    :return: Arrays (i, j) of center indices with i != j, one entry per overlapping pair, or None when giving up.
+    """
+
+    rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+    bucket = 2 * radius + 1
+
+    # Bucket columns shifted by one so the neighbor keys of the first and last column never alias another row
+    bucket_rows, bucket_cols = rows // bucket, cols // bucket + 1
+    stride = int(bucket_cols.max(initial=0)) + 2
+    keys = bucket_rows * stride + bucket_cols
+
+    order = np.argsort(keys, kind="stable")
+    buckets, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    firsts, seconds = [], []
+    checked = 0
+
+    # Half of the neighbors suffice, the other half are the same bucket pairs seen from the other side
+    for d_row, d_col in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        if len(buckets) == 0:
+            break
+
+        target = buckets + d_row * stride + d_col
+        found = np.minimum(np.searchsorted(buckets, target), len(buckets) - 1)
+        a = np.flatnonzero(buckets[found] == target)
+        b = found[a]
+
+        n_pairs = counts[a] * counts[b]
+        checked += int(n_pairs.sum())
+
+        if max_pairs is not None and checked > max_pairs:
+            return None
+
+        # The k-th candidate of a bucket pair is (k // counts[b], k % counts[b])
+        pair = np.repeat(np.arange(len(a)), n_pairs)
+        k = np.arange(len(pair)) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+        i = starts[a][pair] + k // counts[b][pair]
+        j = starts[b][pair] + k % counts[b][pair]
+
+        if d_row == d_col == 0:
+            i, j = i[i < j], j[i < j]
+
+        firsts.append(order[i])
+        seconds.append(order[j])
+
+    i = np.concatenate(firsts) if firsts else np.zeros(0, dtype=np.int64)
+    j = np.concatenate(seconds) if seconds else np.zeros(0, dtype=np.int64)
+    close = np.abs(rows[i] - rows[j]) + np.abs(cols[i] - cols[j]) <= 2 * radius
+
+    return i[close], j[close]
+
+
+def _overlap_components(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    radius: int,
+    max_pairs: T.Optional[int]=None
+) -> T.Optional[np.ndarray]:
+    """
+    Label the connected components of the overlap graph, where two centers are linked when their diamonds share a cell.
+    Cells covered by one component are never covered by another, so components can be counted separately and summed.
+
+    Pairs come from `_overlap_pairs`, then a vectorized union-find runs over all of them at once: every root is hooked
+    onto the smallest root it is linked to, and pointer jumping flattens the trees, until no link joins two roots.
+
+    :param rows: Integer array of center rows.
+    :param cols: Integer array of center columns.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param max_pairs: Give up once `_overlap_pairs` would have to check more candidate pairs than this.
+    :return: Integer array giving each center the index of the smallest center of its component, or None when giving
+     up.
+    """
+
+    pairs = _overlap_pairs(rows, cols, radius, max_pairs=max_pairs)
+    if pairs is None:
+        return None
+
+    i, j = pairs
+    parent = np.arange(len(rows))
+
+    while True:
+        # Pointer jumping, afterwards every center points straight at its root
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+        low, high = np.minimum(parent[i], parent[j]), np.maximum(parent[i], parent[j])
+        joined = low != high
+
+        if not joined.any():
+            return parent
+
+        # Hooking always points at a smaller index, so no cycles can form
+        np.minimum.at(parent, high[joined], low[joined])
+
+
+def _engine_work(method: str, size: T.Tuple[int, int], n_centers: int, radius: int, wraparound: bool=False) -> float:
+    # Asymptotic amount of work each engine does on a problem, scaled into seconds by `_ENGINE_COSTS`
+    height, width = size
+    area = height * width
+    rows = min(2 * radius + 1, height)
+
+    # Sparse engines that clip periodic copies of the centers do work for every copy
+    copies = (2 * -(-radius // height) + 1) * (2 * -(-radius // width) + 1) if wraparound else 1
+
+    if method == "sets":
+        return n_centers * min(2 * radius * (radius + 1) + 1, area) + area
+    if method == "dense":
+        return area * rows
+    if method == "packed":
+        return area * rows * (1 + np.log2(radius + 1)) / 64 + area
+    if method == "distance":
+        return area
+    if method == "intervals":
+        runs = n_centers * rows
+        return runs * np.log2(runs + 2)
+    if method == "sweep":
+        return n_centers * copies * np.log2(n_centers * copies + 2)
+    if method == "imos":
+        return (height + width) ** 2 + n_centers * copies
+
+    raise ValueError(f"Unknown method {method!r}, expected one of {('auto',) + ENGINES}")
+
+
+def _engine_steps(method: str, size: T.Tuple[int, int], n_centers: int, radius: int, wraparound: bool=False) -> float:
+    # Rough number of interpreted steps (mostly NumPy calls) each engine takes, which dominates on small grids
+    height, width = size
+    rows = min(2 * radius + 1, height)
+
+    if method == "sets":
+        return 10 + 4 * n_centers * (2 * radius * (radius + 1) + 1) / _ENUMERATE_CHUNK_CELLS
+    if method == "dense":
+        return 4 * rows
+    if method == "packed":
+        return 2 * rows + 8 * min(radius + 1, height) * (1 + np.log2(radius + 1))
+    if method == "distance":
+        return 4 * (height + width) * (2 if wraparound else 1)
+    if method in ("intervals", "sweep", "imos"):
+        return 30
+
+    raise ValueError(f"Unknown method {method!r}, expected one of {('auto',) + ENGINES}")
+
+
+def _engine_cost(method: str, size: T.Tuple[int, int], n_centers: int, radius: int, wraparound: bool=False) -> float:
+    # Expected seconds for one engine on a problem
+    return (
+        _ENGINE_COSTS[method] * _engine_work(method, size, n_centers, radius, wraparound)
+        + _ENGINE_COSTS["step"] * _engine_steps(method, size, n_centers, radius, wraparound)
+    )
+
+
+def _engine_memory(method: str, size: T.Tuple[int, int], n_centers: int, radius: int, wraparound: bool=False) -> float:
+    # Rough peak bytes each engine allocates on a problem, on top of its input
+    height, width = size
+    area = height * width
+    rows = min(2 * radius + 1, height)
+    copies = (2 * -(-radius // height) + 1) * (2 * -(-radius // width) + 1) if wraparound else 1
+
+    if method == "sets":
+        # Seen mask plus one chunk of cell coordinates, rows, columns, in-bounds flags and linear indices
+        return area + 32 * min(_ENUMERATE_CHUNK_CELLS, n_centers * min(2 * radius * (radius + 1) + 1, area))
+    if method == "dense":
+        # Padded mask, int32 running sums, row runs and the output
+        return 7 * area
+    if method == "packed":
+        return area
+    if method == "distance":
+        # int32 distances and their transposed copy
+        return 8 * area
+    if method == "intervals":
+        # All runs at once, (row, first, last) before and after sorting plus the order and running maximum, for up to
+        # two pieces per row with wraparound
+        return 64 * n_centers * rows * (2 if wraparound else 1)
+    if method == "sweep":
+        return 200 * n_centers * copies
+    if method == "imos":
+        # int32 stamps over the rotated bounding box, the coverage read back from it and the corner stamps
+        return 4 * (height + width) ** 2 + 4 * area + 48 * n_centers * copies
+
+    raise ValueError(f"Unknown method {method!r}, expected one of {('auto',) + ENGINES}")
+
+
+def _choose_engine(size: T.Tuple[int, int], n_centers: int, radius: int, wraparound: bool=False) -> str:
+    """
+    Pick the engine expected to be fastest on a problem from the cost model in `_engine_cost`, among those whose memory
+    use from `_engine_memory` stays within `_ENGINE_MEMORY_PER_CELL` bytes per grid cell (plus a fixed allowance).
+    If none does, the one using the least memory is picked.
+
+    :param size: Pair giving the dimensions of the overall array.
+    :param n_centers: Number of positive centers.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param wraparound: Whether neighborhoods wrap around the edges of the grid.
+    :return: Name of one of `ENGINES`.
+    """
+
+    limit = _ENGINE_MEMORY_PER_CELL * size[0] * size[1] + _ENGINE_MEMORY_ALLOWANCE
+    memory = {method: _engine_memory(method, size, n_centers, radius, wraparound) for method in ENGINES}
+
+    candidates = [method for method in ENGINES if memory[method] <= limit]
+    if not candidates:
+        return min(ENGINES, key=memory.get)
+
+    return min(candidates, key=lambda method: _engine_cost(method, size, n_centers, radius, wraparound))
+
+
+def _saturated(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    size: T.Tuple[int, int],
+    radius: int,
+    wraparound: bool=False
+) -> bool:
+    """
+    Check if the neighborhoods of the given (at least one) centers are known to cover the whole grid without counting.
+
+    No cell of the torus is further than H // 2 + W // 2 from any center, so with wraparound that radius covers it all.
+    On a clipped grid it is enough for one center to reach all four corners, which is the case when its distance to the
+    farthest corner, max(row, H - 1 - row) + max(col, W - 1 - col), is within the radius. Every center is at least
+    H // 2 + W // 2 from its farthest corner too, so smaller radii never saturate and the centers need not be looked at.
+
+    :param rows: Integer array of center rows.
+    :param cols: Integer array of center columns.
+    :param size: Pair giving the dimensions of the overall array.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param wraparound: Whether neighborhoods wrap around the edges of the grid.
+    :return: True if every cell of the grid is within `radius` of a center.
+    """
+
+    height, width = size
+
+    if radius < height // 2 + width // 2:
+        return False
+
+    if wraparound or radius >= height + width - 2:
+        return True
+
+    eccentricity = np.maximum(rows, height - 1 - rows) + np.maximum(cols, width - 1 - cols)
+
+    return bool(eccentricity.min() <= radius)
+
+
+def _covered_mask(mask: np.ndarray, radius: int, wraparound: bool=False) -> np.ndarray:
+    # Boolean mask of every cell within `radius` of a true cell, from whichever of the dilation or the distance map is
+    # cheaper. Works on stacks of masks like both of those.
+    size = mask.shape[-2:]
+
+    if _engine_cost("dense", size, 0, radius, wraparound) < _engine_cost("distance", size, 0, radius, wraparound):
+        return _dilate_dense(mask, radius, wraparound)
+
+    return (_distance_transform(mask, wraparound) <= radius) & mask.any(axis=(-2, -1), keepdims=True)
+
+
+def _count_row_band(X: np.ndarray, first: int, stop: int, radius: int, wraparound: bool=False) -> int:
+    """
+    Count the cells in rows [first, stop) of `X` within `radius` of a positive entry, reading only those rows plus a
+    halo of the rows around them that can reach into the band.
+
+    With wraparound the halo rows are taken modulo the grid height and the columns are padded with copies from the
+    opposite edge, which turns the band into a plain clipped problem. No cell is ever more than half the grid away on
+    the torus, so neither needs to go further than that.
+
+    :param X: 2D array of values, only the rows needed are read so it can be a memory map.
+    :param first: First row of the band.
+    :param stop: One past the last row of the band.
+    :param radius: Radius of Manhattan neighborhood around each positive center point.
+    :param wraparound: Points outside of the grid are discarded by default, if true wrap them around instead.
+    :return: Number of cells of the band within `radius` of a positive entry anywhere in `X`.
+    """
+
+    height, width = X.shape
+
+    if wraparound:
+        halo, pad = min(radius, height // 2), min(radius, width // 2)
+        window = np.pad(X[np.arange(first - halo, stop + halo) % height] > 0, ((0, 0), (pad, pad)), mode="wrap")
+        top = halo
     else:
-        return neighborhood
+        start = max(first - radius, 0)
+        window, pad, top = X[start:min(stop + radius, height)] > 0, 0, first - start
+
+    if not window.any():
+        return 0
+
+    # Any one positive anywhere reaches every cell at this radius
+    if radius >= (height // 2 + width // 2 if wraparound else height + width - 2):
+        return (stop - first) * width
+
+    covered = _covered_mask(window, radius)
+
+    return int(np.count_nonzero(covered[top:top + stop - first, pad:pad + width]))
+
+
+def _count_streamed(X: np.ndarray, radius: int, wraparound: bool=False) -> int:
+    # Count a grid too big for memory one band of rows at a time. Each band is read together with its halo, so at most
+    # about `_STREAM_BLOCK_CELLS` cells of the grid are held (and thresholded) at once. When the halos alone are over
+    # that budget, bands are kept at least as tall as both halos together, otherwise every row would be read and
+    # dilated again for each of the 2r + 1 bands whose halo it is in. Memory then goes up to about 4 halos of rows.
+    height, width = X.shape
+    halo = min(radius, height // 2 if wraparound else height)
+    block = max(_STREAM_BLOCK_CELLS // max(width, 1) - 2 * halo, 2 * halo, 1)
+
+    return sum(
+        _count_row_band(X, first, min(first + block, height), radius, wraparound) for first in range(0, height, block)
+    )
+
+
+def _run_engine(
+    method: str,
+    mask: T.Optional[np.ndarray],
+    rows: T.Optional[np.ndarray],
+    cols: T.Optional[np.ndarray],
+    size: T.Tuple[int, int],
+    radius: int,
+    wraparound: bool=False
+) -> int:
+    # Run one engine on whichever of the dense mask or the center coordinates it needs, building the other one from
+    # the one given if necessary.
+    if method in MASK_ENGINES and mask is None:
+        mask = np.zeros(size, dtype=bool)
+        mask[rows, cols] = True
+
+    if method in CENTER_ENGINES and rows is None:
+        rows, cols = (axis.astype(np.int64) for axis in np.nonzero(mask))
+
+    if method == "sets":
+        return _count_sets(mask, radius, wraparound)
+    if method == "dense":
+        return int(np.count_nonzero(_dilate_dense(mask, radius, wraparound)))
+    if method == "packed":
+        return _count_packed(mask, radius, wraparound)
+    if method == "distance":
+        return int(np.count_nonzero(_distance_transform(mask, wraparound) <= radius))
+    if method == "intervals":
+        return _count_intervals(rows, cols, size, radius, wraparound)
+    if method == "sweep":
+        return _count_sweep(rows, cols, size, radius, wraparound)
+    if method == "imos":
+        return int(np.count_nonzero(_coverage_imos(rows, cols, size, radius, wraparound)))
+
+    raise ValueError(f"Unknown method {method!r}, expected one of {('auto',) + ENGINES}")
+
+
+def _count_auto(
+    mask: T.Optional[np.ndarray],
+    rows: T.Optional[np.ndarray],
+    cols: T.Optional[np.ndarray],
+    size: T.Tuple[int, int],
+    n_centers: int,
+    radius: int,
+    wraparound: bool=False
+) -> int:
+    """
+    Count with the engine chosen by the cost model, first splitting off centers whose diamond overlaps no other one.
+
+    An isolated diamond covers exactly its clipped area, `_clipped_diamond_area`, so only the centers in overlapping
+    clusters go through an engine. The split is skipped with wraparound, where diamonds can reach around onto
+    themselves, and whenever the cost model expects it to save less than it costs, e.g. on small or crowded grids.
+
+    :param mask: Boolean mask of the centers, or None if `rows` and `cols` are given.
+    :param rows: Integer array of center rows, or None to take them from `mask`.
+    :param cols: Integer array of center columns, or None to take them from `mask`.
+    :param size: Pair giving the dimensions of the overall array.
+    :param n_centers: Number of centers.
+    :param radius: Manhattan radius of the neighborhood about each center.
+    :param wraparound: Wrap neighborhoods around the edges of the grid instead of clipping them.
+    :return: Number of cells within `radius` of at least one center.
+    """
+
+    method = _choose_engine(size, n_centers, radius, wraparound)
+
+    if wraparound or n_centers < 2:
+        return _run_engine(method, mask, rows, cols, size, radius, wraparound)
+
+    # Expected share of centers with no other one within 2 * radius, if they were spread uniformly. The split pays off
+    # when the engine run it saves on those is worth more than finding them.
+    reach = 2 * radius
+    isolated = np.exp(-n_centers * (2 * reach * (reach + 1) + 1) / (size[0] * size[1]))
+    n_rest = int(n_centers * (1 - isolated))
+
+    saving = _engine_cost(method, size, n_centers, radius) - _engine_cost(
+        _choose_engine(size, n_rest, radius), size, n_rest, radius
+    )
+    isolation_cost = (
+        _ENGINE_COSTS["step"] * _ISOLATION_STEPS + _ENGINE_COSTS["isolation"] * n_centers * np.log2(n_centers)
+    )
+
+    if saving < isolation_cost:
+        return _run_engine(method, mask, rows, cols, size, radius, wraparound)
+
+    if rows is None:
+        rows, cols = (axis.astype(np.int64) for axis in np.nonzero(mask))
+
+    pairs = _overlap_pairs(rows, cols, radius, max_pairs=_ISOLATION_PAIRS_PER_CENTER * n_centers)
+    if pairs is None:
+        return _run_engine(method, mask, rows, cols, size, radius, wraparound)
+
+    overlapping = np.zeros(len(rows), dtype=bool)
+    overlapping[pairs[0]] = overlapping[pairs[1]] = True
+
+    count = int(_clipped_diamond_area(rows[~overlapping], cols[~overlapping], size, radius).sum())
+
+    rows, cols = rows[overlapping], cols[overlapping]
+    if len(rows) == 0:
+        return count
+
+    method = _choose_engine(size, len(rows), radius, wraparound)
 
-def count_positive_neighborhood_size(X: np.ndarray, radius: int, wraparound: bool=False) -> int:
+    return count + _run_engine(method, None, rows, cols, size, radius, wraparound)
+
+
+def manhattan_distance_to_positive(X: np.ndarray, wraparound: bool=False) -> np.ndarray:
+    """
+    Compute the Manhattan/L1 distance from every cell of a grid to the nearest positive value in the array. A cell is
+    within radius `r` of a positive entry exactly when its distance is `<= r`, so one distance map answers
+    `count_positive_neighborhood_size` for every radius.
+
+    :param X: 2D Numpy array of values. They can be any type as long as they can be compared greater than 0.
+    :param wraparound: Measure distances on the torus, i.e. wrapping around the edges of the grid.
+    :return: Array with the same shape as `X` using the smallest unsigned integer type that fits. If `X` has no positive
+     entries every cell is `H + W`, which is larger than any distance on the grid.
+    """
+
+    if len(X.shape) != 2:
+        raise ValueError("X must be a 2-dimensional array")
+
+    height, width = X.shape
+    dist = _distance_transform(X > 0, wraparound)
+
+    return dist.astype(np.min_scalar_type(height + width))
+
+
+def count_positive_neighborhood_size(
+    X: T.Union[np.ndarray, str, os.PathLike],
+    radius: int,
+    wraparound: bool=False,
+    method: str="auto"
+) -> int:
     """
     Count the number of cells in a grid within a given Manhattan radius of any positive value in the array. Actual
     values in the input array are ignored, it only matters if a given entry is positive. Positive center points are
@@ -74,47 +1384,146 @@ def count_positive_neighborhood_size(X: np.ndarray, radius: int, wraparound: boo
 
     Beware that values of zero are by definition *not* positive.
 
-    :param X: 2D Numpy array of values. They can be any type as long as they can be compared greater than 0.
+    Several counting engines are available and by default the one expected to be fastest for the grid shape, number of
+    positives, radius and wraparound mode is used. All of them give the same count. Radii large enough that the
+    neighborhoods are known to cover the whole grid return H * W straight away.
+
+    Grids larger than memory can be given as a `np.memmap` or the path to a `.npy` file. They are streamed through in
+    bands of rows, so only a bounded slice of the grid is ever in memory (about `4 * radius` rows when those are more
+    than the band budget).
+
+    :param X: 2D Numpy array of values. They can be any type as long as they can be compared greater than 0. Can also
+     be a memory map, or a path to a `.npy` file which is memory mapped.
     :param radius: Radius of Manhattan neighborhood around each positive center point.
     :param wraparound: Points outside of the grid are discarded by default, if true wrap them around instead.
+    :param method: "auto" to pick the engine automatically, or force one of `ENGINES`. Memory maps are always streamed
+     and ignore this.
     :return: Integer count of the number of cells in the input array within given Manhattan distance to a positive
      entry.
     """
 
+    if isinstance(X, (str, os.PathLike)):
+        X = np.load(X, mmap_mode="r")
+
     # Check some basic problem assumptions
     if len(X.shape) != 2:
         raise ValueError("X must be a 2-dimensional array")
 
+    if method != "auto" and method not in ENGINES:
+        raise ValueError(f"Unknown method {method!r}, expected one of {('auto',) + ENGINES}")
+
+    if radius < 0:
+        raise ValueError("radius must not be negative")
+
+    # Thresholding the whole map would pull all of it into memory, twice
+    if isinstance(X, np.memmap):
+        return _count_streamed(X, radius, wraparound)
+
     # ...
     # Not checking wacko cases like zero dimension axes etc. There are other pathological cases you can enumerate as
     # needed.
 
-    positive_centers = list(array_to_pos_center_coordinates(X))
+    mask = X > 0
+    n_centers = int(np.count_nonzero(mask))
 
-    # Catching case where X is all zero/negative otherwise it's tricky to handle with Python's iterator typing being
-    # weird.
-    if len(positive_centers) == 0:
+    if n_centers == 0:
         return 0
 
-    all_neighbors = reduce(
-        operator.or_, # or_ for Sets is union
-        [
-            manhattan_neighborhood(center, radius, prune_wraparound=(not wraparound),  size=X.shape)
-            for center in positive_centers
-        ]
-    )
+    # Parameter sweeps spend a lot of time at radii that cover everything, only look at the centers when they might
+    rows = cols = None
+    if radius >= X.shape[0] // 2 + X.shape[1] // 2:
+        rows, cols = (axis.astype(np.int64) for axis in np.nonzero(mask))
 
-    # The neighborhood finder algorithm excludes centers on purpose, so now add them in.
-    # Note that it's possible for a center point to fall within the neighborhood of another center so it already may be
-    # `all_neighbors`, the Set object enforces uniqueness so that we get no duplicates.
-    all_neighbors.update(positive_centers)
+        if _saturated(rows, cols, X.shape, radius, wraparound):
+            return X.size
 
-    x_max, y_max = X.shape
+    if method == "auto":
+        return _count_auto(mask, rows, cols, X.shape, n_centers, radius, wraparound)
 
-    if wraparound:
-        # coordinates over the edges get wrapped around
-        all_neighbors = set([
-            (x % x_max, y % y_max) for (x, y) in all_neighbors
-        ])
+    return _run_engine(method, mask, rows, cols, X.shape, radius, wraparound)
+
+
+def count_center_neighborhood_size(
+    centers: np.ndarray,
+    size: T.Tuple[int, int],
+    radius: int,
+    wraparound: bool=False,
+    method: str="auto"
+) -> int:
+    """
+    Count the number of cells in a grid within a given Manhattan radius of any of a list of centers. This is
+    `count_positive_neighborhood_size` for callers that already have the positive coordinates, the dense grid is only
+    built if a dense engine is forced or is the cheapest one for a small grid. Repeated centers are fine.
+
+    :param centers: Integer array of shape (n, 2) giving the (row, col) of each center.
+    :param size: Pair giving the dimensions of the overall array.
+    :param radius: Radius of Manhattan neighborhood around each center point.
+    :param wraparound: Points outside of the grid are discarded by default, if true wrap them around instead.
+    :param method: "auto" to pick the engine automatically, or force one of `ENGINES`. Engines in `MASK_ENGINES` build
+     the dense grid first.
+    :return: Integer count of the number of cells in the grid within given Manhattan distance to a center.
+    """
+
+    if method != "auto" and method not in ENGINES:
+        raise ValueError(f"Unknown method {method!r}, expected one of {('auto',) + ENGINES}")
+
+    if radius < 0:
+        raise ValueError("radius must not be negative")
+
+    centers = np.asarray(centers)
+
+    # An empty list comes through as a float array with no second axis
+    if centers.size == 0:
+        centers = np.zeros((0, 2), dtype=np.int64)
+
+    if centers.ndim != 2 or centers.shape[1] != 2:
+        raise ValueError("centers must be an (n, 2) array of coordinates")
+
+    if not np.issubdtype(centers.dtype, np.integer):
+        raise ValueError("centers must be integer coordinates")
+
+    if len(size) != 2:
+        raise ValueError("size must give the 2 dimensions of the grid")
+
+    rows, cols = centers[:, 0].astype(np.int64), centers[:, 1].astype(np.int64)
+
+    if ((rows < 0) | (rows >= size[0]) | (cols < 0) | (cols >= size[1])).any():
+        raise ValueError("centers must lie within the grid")
+
+    if len(rows) == 0:
+        return 0
+
+    if _saturated(rows, cols, size, radius, wraparound):
+        return size[0] * size[1]
+
+    if method == "auto":
+        return _count_auto(None, rows, cols, size, len(rows), radius, wraparound)
+
+    return _run_engine(method, None, rows, cols, size, radius, wraparound)
+
+
+def count_positive_neighborhood_sizes(X: np.ndarray, radii: T.Iterable[int], wraparound: bool=False) -> np.ndarray:
+    """
+    Same as `count_positive_neighborhood_size` but for many radii at once. The distance map is computed a single time
+    and turned into a cumulative histogram, so every radius after the first is a lookup.
+
+    :param X: 2D Numpy array of values. They can be any type as long as they can be compared greater than 0.
+    :param radii: Radii of the Manhattan neighborhoods to count, in any order. None of them may be negative.
+    :param wraparound: Points outside of the grid are discarded by default, if true wrap them around instead.
+    :return: Integer array of counts with the same shape as `radii`.
+    """
+
+    radii = np.asarray(radii, dtype=np.int64)
+
+    if (radii < 0).any():
+        raise ValueError("radii must not be negative")
+
+    dist = manhattan_distance_to_positive(X, wraparound=wraparound)
+
+    height, width = X.shape
+
+    # Distances run from 0 to H + W - 2 and no positives at all shows up as H + W, which the histogram leaves out.
+    coverage = np.cumsum(np.bincount(dist.ravel(), minlength=height + width + 1)[:height + width - 1])
+
+    return coverage[np.minimum(radii, height + width - 2)]
 
-    return len(all_neighbors)
\ No newline at end of file
@@ -0,0 +1,273 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+
+import typing as T
+
+from .manhattan import (
+    _ISOLATION_PAIRS_PER_CENTER,
+    _choose_engine,
+    _clipped_diamond_area,
+    _count_row_band,
+    _overlap_components,
+    _run_engine,
+    _saturated,
+    count_positive_neighborhood_size,
+)
+
+# Shared memory block attached by each worker process, see `_attach_grids`.
+_worker_block = None
+
+# Most centers counted together by `count_positive_neighborhood_size_clustered`, unless a single cluster is larger.
+_CLUSTER_CHUNK_CENTERS = 4096
+
+
+def _attach_grids(name: str, size: int):
+    # Pool initializer, maps the parent's block of packed grids into this worker without copying it
+    global _worker_block
+
+    try:
+        block = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching always registers the block with the resource tracker. Workers share the
+        # parent's tracker, and the parent unlinks the block once the pool is done.
+        block = shared_memory.SharedMemory(name=name)
+
+    _worker_block = (block, np.ndarray((size,), dtype=bool, buffer=block.buf))
+
+
+def _count_chunk(
+    chunk: T.Sequence[T.Tuple[int, int, int]],
+    radius: int,
+    wraparound: bool,
+    method: str
+) -> T.List[int]:
+    # Count the grids at (offset, height, width) in the shared block, only the integers travel back to the parent
+    _, packed = _worker_block
+
+    return [
+        count_positive_neighborhood_size(
+            packed[offset:offset + height * width].reshape(height, width), radius, wraparound=wraparound, method=method
+        )
+        for offset, height, width in chunk
+    ]
+
+
+def count_many(
+    grids: T.Iterable[np.ndarray],
+    radius: int,
+    wraparound: bool=False,
+    workers: T.Optional[int]=None,
+    method: str="auto"
+) -> np.ndarray:
+    """
+    Run `count_positive_neighborhood_size` over many grids on a pool of worker processes.
+
+    The positive masks of all grids are packed into one `multiprocessing.shared_memory` block that the workers read in
+    place, so grids are never pickled. Workers get the grids in interleaved chunks and only send back the counts.
+
+    :param grids: 2D Numpy arrays of values, compared greater than 0 like in `count_positive_neighborhood_size`.
+    :param radius: Radius of Manhattan neighborhood around each positive center point.
+    :param wraparound: Points outside of the grid are discarded by default, if true wrap them around instead.
+    :param workers: Number of worker processes, defaults to the number of CPUs. With 1 everything runs in this process.
+    :param method: Counting engine passed on to `count_positive_neighborhood_size`.
+    :return: Integer array with one count per grid.
+    """
+
+    masks = [np.asarray(grid) > 0 for grid in grids]
+
+    if any(mask.ndim != 2 for mask in masks):
+        raise ValueError("every grid must be a 2-dimensional array")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    if radius < 0:
+        raise ValueError("radius must not be negative")
+
+    if workers == 1 or len(masks) <= 1:
+        return np.array(
+            [count_positive_neighborhood_size(mask, radius, wraparound=wraparound, method=method) for mask in masks],
+            dtype=np.int64,
+        )
+
+    sizes = [mask.size for mask in masks]
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).tolist()
+    total = sum(sizes)
+
+    # A few chunks per worker evens out grids of different cost without paying task overhead per grid
+    layout = [(offset, *mask.shape) for offset, mask in zip(offsets, masks)]
+    n_chunks = min(len(layout), 4 * workers)
+    chunks = [layout[i::n_chunks] for i in range(n_chunks)]
+
+    block = shared_memory.SharedMemory(create=True, size=max(total, 1))
+
+    try:
+        packed = np.ndarray((total,), dtype=bool, buffer=block.buf)
+        for offset, mask in zip(offsets, masks):
+            packed[offset:offset + mask.size] = mask.ravel()
+        del packed
+
+        count_chunk = partial(_count_chunk, radius=radius, wraparound=wraparound, method=method)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_grids, initargs=(block.name, total)) as pool:
+            results = list(pool.map(count_chunk, chunks))
+    finally:
+        block.close()
+        block.unlink()
+
+    counts = np.zeros(len(masks), dtype=np.int64)
+    for i, chunk_counts in enumerate(results):
+        counts[i::n_chunks] = chunk_counts
+
+    return counts
+
+
+def count_positive_neighborhood_size_tiled(
+    X: np.ndarray,
+    radius: int,
+    wraparound: bool=False,
+    workers: T.Optional[int]=None,
+    band_rows: T.Optional[int]=None
+) -> int:
+    """
+    Same as `count_positive_neighborhood_size` for one very large grid, split into bands of rows counted on a thread
+    pool. Each band is dilated together with a halo of `radius` rows on either side, but only its own rows are counted,
+    so the band counts add up without double counting. The NumPy kernels doing the work release the GIL.
+
+    :param X: 2D Numpy array of values. They can be any type as long as they can be compared greater than 0.
+    :param radius: Radius of Manhattan neighborhood around each positive center point.
+    :param wraparound: Points outside of the grid are discarded by default, if true wrap them around instead.
+    :param workers: Number of threads, defaults to the number of CPUs.
+    :param band_rows: Rows per band, by default a few bands per thread but never much thinner than the halo.
+    :return: Integer count of the number of cells in the input array within given Manhattan distance to a positive
+     entry.
+    """
+
+    if len(X.shape) != 2:
+        raise ValueError("X must be a 2-dimensional array")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    if radius < 0:
+        raise ValueError("radius must not be negative")
+
+    height = X.shape[0]
+
+    if band_rows is None:
+        band_rows = max(-(-height // (4 * workers)), 2 * radius, 1)
+
+    bands = [(first, min(first + band_rows, height)) for first in range(0, height, band_rows)]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = pool.map(lambda band: _count_row_band(X, band[0], band[1], radius, wraparound), bands)
+
+    return sum(counts)
+
+
+def _count_cluster_chunk(rows: np.ndarray, cols: np.ndarray, size: T.Tuple[int, int], radius: int) -> int:
+    # Count whole clusters on the part of the grid their diamonds can reach. Clipping to that box is the same as
+    # clipping to the grid, no diamond leaves the box anywhere but at the grid edges.
+    top, left = max(int(rows.min()) - radius, 0), max(int(cols.min()) - radius, 0)
+    bottom, right = min(int(rows.max()) + radius + 1, size[0]), min(int(cols.max()) + radius + 1, size[1])
+
+    box = (bottom - top, right - left)
+    method = _choose_engine(box, len(rows), radius)
+
+    return _run_engine(method, None, rows - top, cols - left, box, radius)
+
+
+def count_positive_neighborhood_size_clustered(
+    X: np.ndarray,
+    radius: int,
+    wraparound: bool=False,
+    workers: T.Optional[int]=None
+) -> int:
+    """
+    Same as `count_positive_neighborhood_size`, split into clusters of positives whose neighborhoods overlap. Clusters
+    cover disjoint cells, so each is counted on its own and the counts are summed. No count ever takes in more than
+    a bounded number of positives (or one whole cluster, if that is larger), and clusters are counted on a thread pool.
+
+    Clusters are the connected components of the graph linking positives within `2 * radius` of each other, found
+    with a spatial hash and union-find. Positives on their own count their clipped diamond in closed form. Nearby
+    clusters are counted together on the part of the grid they can reach, in chunks of about
+    `_CLUSTER_CHUNK_CENTERS` positives.
+
+    With wraparound the clusters would have to be found on the torus, and on crowded grids finding them would cost more
+    than counting, so in both cases the grid is counted in one go instead.
+
+    :param X: 2D Numpy array of values. They can be any type as long as they can be compared greater than 0.
+    :param radius: Radius of Manhattan neighborhood around each positive center point.
+    :param wraparound: Points outside of the grid are discarded by default, if true wrap them around instead.
+    :param workers: Number of threads, defaults to the number of CPUs.
+    :return: Integer count of the number of cells in the input array within given Manhattan distance to a positive
+     entry.
+    """
+
+    if len(X.shape) != 2:
+        raise ValueError("X must be a 2-dimensional array")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    if radius < 0:
+        raise ValueError("radius must not be negative")
+
+    if wraparound:
+        return count_positive_neighborhood_size(X, radius, wraparound=True)
+
+    rows, cols = (axis.astype(np.int64) for axis in np.nonzero(X > 0))
+
+    if len(rows) == 0:
+        return 0
+
+    if _saturated(rows, cols, X.shape, radius):
+        return X.size
+
+    # Crowded grids have too many candidate pairs to find the clusters cheaply, and hardly any clusters to split off
+    labels = _overlap_components(rows, cols, radius, max_pairs=_ISOLATION_PAIRS_PER_CENTER * len(rows))
+    if labels is None:
+        return count_positive_neighborhood_size(X, radius)
+
+    sizes = np.bincount(labels, minlength=len(rows))
+
+    alone = sizes[labels] == 1
+    count = int(_clipped_diamond_area(rows[alone], cols[alone], X.shape, radius).sum())
+
+    # Order the clustered positives by cluster, clusters by their first positive which is also their top-most (ties
+    # broken by column), so consecutive clusters are close together and chunks cover compact bands of the grid
+    clustered = np.flatnonzero(~alone)
+    clustered = clustered[np.argsort(labels[clustered], kind="stable")]
+    rows, cols, labels = rows[clustered], cols[clustered], labels[clustered]
+
+    if len(labels) == 0:
+        return count
+
+    # Chunks end where a cluster ends, so a cluster is never split
+    cluster_ends = np.flatnonzero(np.diff(labels)) + 1
+    bounds = [0]
+    for end in np.append(cluster_ends, len(labels)):
+        if end - bounds[-1] >= _CLUSTER_CHUNK_CENTERS or end == len(labels):
+            bounds.append(int(end))
+
+    chunks = list(zip(bounds[:-1], bounds[1:]))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = pool.map(
+            lambda chunk: _count_cluster_chunk(rows[chunk[0]:chunk[1]], cols[chunk[0]:chunk[1]], X.shape, radius),
+            chunks,
+        )
+
+        return count + sum(counts)
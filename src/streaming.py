@@ -0,0 +1,91 @@
+import numpy as np
+
+import typing as T
+
+
+def _row_distance(row: np.ndarray, missing: int) -> np.ndarray:
+    # Distance along the row from every cell to the nearest positive cell of the same row, `missing` when there is none
+    width = len(row)
+    positives = np.flatnonzero(row > 0)
+    columns = np.arange(width)
+
+    if len(positives) == 0:
+        return np.full(width, missing, dtype=np.int64)
+
+    after = np.searchsorted(positives, columns)
+    left = columns - positives[np.maximum(after - 1, 0)]
+    right = positives[np.minimum(after, len(positives) - 1)] - columns
+
+    # Pick whichever neighbor is on the correct side, a negative distance means the neighbor is on the wrong one
+    left = np.where(left >= 0, left, missing)
+    right = np.where(right >= 0, right, missing)
+
+    return np.minimum(left, right)
+
+
+def iter_positive_neighborhood_counts(rows: T.Iterable[np.ndarray], width: int, radius: int) -> T.Iterator[int]:
+    """
+    Count the cells within a Manhattan radius of a positive value of a grid that arrives one row, or one block of rows,
+    at a time. Only the last `2 * radius + 1` rows are kept, as their distances along the row to the nearest positive
+    cell. A row's coverage is final as soon as the `radius` rows after it have arrived, since no later row can reach it.
+
+    The grid height is not known up front, so neighborhoods are always clipped at the edges, there is no wraparound.
+
+    :param rows: Iterable of 1D arrays of `width` values, or 2D blocks of such rows. Values are compared greater than 0.
+    :param width: Number of columns of the grid.
+    :param radius: Radius of Manhattan neighborhood around each positive center point.
+    :return: Iterator yielding the running count of covered cells in the finalized rows after each item of `rows`, and
+     once more at the end. The last value is the count for the whole grid.
+    """
+
+    if radius < 0:
+        raise ValueError("radius must not be negative")
+
+    window = 2 * radius + 1
+
+    # Ring buffer, the row with index i lives in slot i % window. Rows without positives, and missing rows before the
+    # first one or after the last, are further away than the radius. Distances are capped there so they fit the
+    # smallest type that holds it. The buffer only grows up to `window` rows as rows arrive, a huge radius over a short
+    # grid never needs all of them.
+    missing = radius + 1
+    distances = np.full((0, width), missing, dtype=np.min_scalar_type(missing))
+
+    count = 0
+    received = 0
+
+    def finalize(row: int) -> int:
+        # Covered cells of `row`, all rows within `radius` of it must already be in the buffer
+        slots = np.arange(len(distances))
+        slot_rows = row - radius + (slots - (row - radius)) % window
+        return int(np.count_nonzero((distances + np.abs(slot_rows - row)[:, None]).min(axis=0) <= radius))
+
+    for item in rows:
+        item = np.asarray(item)
+        block = item.reshape(1, -1) if item.ndim == 1 else item
+
+        if block.ndim != 2 or block.shape[1] != width:
+            raise ValueError(f"rows must have {width} columns")
+
+        for row in block:
+            # Until the buffer is full no slot has been reused, slot i still holds row i
+            if received == len(distances) < window:
+                grown = np.full((min(max(2 * received, 1), window), width), missing, dtype=distances.dtype)
+                grown[:received] = distances
+                distances = grown
+
+            distances[received % window] = np.minimum(_row_distance(row, missing), missing)
+            received += 1
+
+            if received > radius:
+                count += finalize(received - 1 - radius)
+
+        yield count
+
+    # The remaining rows are final once the rows that were never sent are cleared out of the buffer. Slots past the
+    # end of a buffer that never filled up were never written.
+    for row in range(max(received - radius, 0), received):
+        if (row + radius) % window < len(distances):
+            distances[(row + radius) % window] = missing
+        count += finalize(row)
+
+    yield count
@@ -1,7 +1,22 @@
 import pytest
 import itertools
+import json
 import numpy as np
-from src import count_positive_neighborhood_size
+from src import (
+    CoverageIndex,
+    ENGINES,
+    count_center_neighborhood_size,
+    count_positive_neighborhood_size,
+    count_positive_neighborhood_sizes,
+    count_positive_neighborhood_size_batch,
+    count_positive_neighborhood_size_ragged,
+    count_many,
+    count_positive_neighborhood_size_clustered,
+    count_positive_neighborhood_size_tiled,
+    iter_positive_neighborhood_counts,
+    update_coverage,
+    manhattan_distance_to_positive,
+)
 
 import random
 
@@ -158,3 +173,804 @@ def test_rectangular_transpose_invariant():
     c2 = count_positive_neighborhood_size(X2, 2)
 
     assert c1 == c2
+
+## Engine consistency, every engine must agree with the original set-union implementation
+
+def random_grid(height, width, density, seed):
+    rng = np.random.default_rng(seed)
+    return (rng.random((height, width)) < density).astype(int)
+
+def reference_count(X, radius, wraparound=False):
+    # Plain union of per-center coordinate sets, the original algorithm
+    height, width = X.shape
+    covered = set()
+    for x, y in zip(*np.nonzero(X > 0)):
+        for d_x in range(-radius, radius + 1):
+            for d_y in range(abs(d_x) - radius, radius - abs(d_x) + 1):
+                if wraparound:
+                    covered.add(((x + d_x) % height, (y + d_y) % width))
+                elif 0 <= x + d_x < height and 0 <= y + d_y < width:
+                    covered.add((x + d_x, y + d_y))
+    return len(covered)
+
+ENGINE_CASES = [
+    # height, width, density, radius
+    (11, 11, 0.05, 3),
+    (13, 7, 0.2, 2),
+    (1, 21, 0.1, 4),
+    (9, 1, 0.3, 2),
+    (6, 5, 0.1, 7),
+    (20, 30, 0.01, 0),
+    (16, 16, 0.02, 20),
+]
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+@pytest.mark.parametrize("height,width,density,radius", ENGINE_CASES)
+def test_set_engine_matches_reference(height, width, density, radius, wraparound, monkeypatch):
+    from src import manhattan
+
+    # Small chunks so centers are enumerated over several passes
+    monkeypatch.setattr(manhattan, "_ENUMERATE_CHUNK_CELLS", 50)
+
+    for seed in range(3):
+        X = random_grid(height, width, density, seed)
+        assert manhattan._count_sets(X, radius, wraparound) == reference_count(X, radius, wraparound)
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+@pytest.mark.parametrize("height,width,density,radius", ENGINE_CASES)
+def test_dense_engine_matches_sets(height, width, density, radius, wraparound):
+    from src.manhattan import _dilate_dense
+
+    for seed in range(3):
+        X = random_grid(height, width, density, seed)
+        expected = reference_count(X, radius, wraparound)
+        assert _dilate_dense(X > 0, radius, wraparound).sum() == expected
+        assert count_positive_neighborhood_size(X, radius, wraparound=wraparound) == expected
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+@pytest.mark.parametrize("height,width,density,radius", ENGINE_CASES)
+def test_distance_engine_matches_sets(height, width, density, radius, wraparound):
+    from src.manhattan import _distance_transform
+
+    for seed in range(3):
+        X = random_grid(height, width, density, seed)
+        if not X.any():
+            continue
+        assert (_distance_transform(X > 0, wraparound) <= radius).sum() == reference_count(X, radius, wraparound)
+
+def test_large_radius_uses_distance_path():
+    X = centers_to_array([(0, 0), (299, 0), (120, 200)], 300, 300)
+    assert count_positive_neighborhood_size(X, 150) == reference_count(X, 150)
+
+## Distance map API
+
+def test_distance_map_small():
+    X = centers_to_array([(1, 1)], 4, 3)
+    expected = np.array([
+        [2, 1, 2, 3],
+        [1, 0, 1, 2],
+        [2, 1, 2, 3],
+    ])
+    dist = manhattan_distance_to_positive(X)
+    assert dist.dtype == np.uint8
+    np.testing.assert_array_equal(dist, expected)
+
+    X = centers_to_array([(1, 1)], 5, 4)
+    np.testing.assert_array_equal(
+        manhattan_distance_to_positive(X, wraparound=True),
+        [
+            [2, 1, 2, 3, 3],
+            [1, 0, 1, 2, 2],
+            [2, 1, 2, 3, 3],
+            [3, 2, 3, 4, 4],
+        ]
+    )
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_distance_map_answers_every_radius(wraparound):
+    X = random_grid(17, 23, 0.03, 0)
+    dist = manhattan_distance_to_positive(X, wraparound=wraparound)
+    for radius in range(0, 25):
+        assert (dist <= radius).sum() == count_positive_neighborhood_size(X, radius, wraparound=wraparound)
+
+def test_distance_map_no_positives():
+    dist = manhattan_distance_to_positive(np.zeros((300, 5)))
+    assert dist.dtype == np.uint16
+    assert (dist == 305).all()
+
+## Multiple radii in one pass
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_coverage_curve_matches_single_counts(wraparound):
+    X = random_grid(12, 19, 0.02, 3)
+    radii = [5, 0, 3, 40, 1, 12]
+    counts = count_positive_neighborhood_sizes(X, radii, wraparound=wraparound)
+    assert list(counts) == [count_positive_neighborhood_size(X, r, wraparound=wraparound) for r in radii]
+
+def test_coverage_curve_examples():
+    X = centers_to_array([(7, 3), (3, 7)], 11, 11)
+    assert list(count_positive_neighborhood_sizes(X, range(3))) == [2, 10, 26]
+
+def test_coverage_curve_keeps_radii_shape():
+    X = centers_to_array([(7, 3), (3, 7)], 11, 11)
+
+    counts = count_positive_neighborhood_sizes(X, 2)
+    assert counts.shape == () and counts == 26
+
+    counts = count_positive_neighborhood_sizes(X, [[0, 1], [2, 1]])
+    assert counts.tolist() == [[2, 10], [26, 10]]
+
+def test_coverage_curve_no_positives():
+    X = centers_to_array([], 11, 11)
+    assert list(count_positive_neighborhood_sizes(X, [0, 3, 100])) == [0, 0, 0]
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+@pytest.mark.parametrize("height,width,density,radius", ENGINE_CASES + [(5, 150, 0.01, 70), (3, 64, 0.05, 9)])
+def test_packed_engine_matches_sets(height, width, density, radius, wraparound):
+    from src.manhattan import _count_packed
+
+    for seed in range(3):
+        X = random_grid(height, width, density, seed)
+        assert _count_packed(X > 0, radius, wraparound) == reference_count(X, radius, wraparound)
+
+## Sparse engines working from center coordinates only
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+@pytest.mark.parametrize("height,width,density,radius", ENGINE_CASES)
+def test_sweep_engine_matches_sets(height, width, density, radius, wraparound):
+    from src.manhattan import _count_sweep
+
+    for seed in range(3):
+        X = random_grid(height, width, density, seed)
+        rows, cols = np.nonzero(X)
+        assert _count_sweep(rows, cols, X.shape, radius, wraparound) == reference_count(X, radius, wraparound)
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+@pytest.mark.parametrize("height,width,density,radius", ENGINE_CASES)
+def test_interval_engine_matches_sets(height, width, density, radius, wraparound):
+    from src.manhattan import _count_intervals
+
+    for seed in range(3):
+        X = random_grid(height, width, density, seed)
+        rows, cols = np.nonzero(X)
+        assert _count_intervals(rows, cols, X.shape, radius, wraparound) == reference_count(X, radius, wraparound)
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+@pytest.mark.parametrize("height,width,density,radius", ENGINE_CASES)
+def test_imos_engine_matches_sets(height, width, density, radius, wraparound):
+    from src.manhattan import _coverage_imos
+
+    for seed in range(3):
+        X = random_grid(height, width, density, seed)
+        rows, cols = np.nonzero(X)
+        coverage = _coverage_imos(rows, cols, X.shape, radius, wraparound)
+        assert np.count_nonzero(coverage) == reference_count(X, radius, wraparound)
+
+def test_imos_coverage_multiplicity():
+    from src.manhattan import _coverage_imos
+
+    coverage = _coverage_imos(np.array([1, 1, 2]), np.array([1, 2, 2]), (3, 4), 1)
+    np.testing.assert_array_equal(coverage, [
+        [0, 1, 1, 0],
+        [1, 2, 3, 1],
+        [0, 2, 2, 1],
+    ])
+
+def test_sweep_engine_huge_grid():
+    from src.manhattan import _count_sweep
+
+    size = (10 ** 6, 10 ** 6)
+    radius = 1000
+    diamond = 2 * radius ** 2 + 2 * radius + 1
+
+    # Far apart centers, one of them clipped to a quarter (plus the two shared half axes) in the corner
+    rows, cols = np.array([500000, 10, 0]), np.array([500000, 999990, 0])
+    corner = (radius + 1) * (radius + 2) // 2
+    shifted = diamond - (radius - 10) ** 2 - (radius - 9) ** 2 + (radius - 20) * (radius - 19) // 2
+
+    assert _count_sweep(rows, cols, size, radius) == diamond + shifted + corner
+
+@pytest.mark.parametrize(
+    "height,width,centers,radius,count",
+    [
+        (11, 11, [(5, 5)], 3, 25),
+        (11, 11, [(7, 3), (6, 5)], 2, 22),
+        (11, 11, [(0, 0), (0, 10), (10, 0), (10, 10)], 3, 40),
+        (1, 21, [(0, 5)], 3, 7),
+        (11, 11, [(5, 5), (5, 5)], 1, 5),
+        (11, 11, [], 3, 0),
+    ],
+    ids=["single", "overlap", "corners", "single_row", "repeated", "empty"],
+)
+def test_center_list_examples(height, width, centers, radius, count):
+    assert count_center_neighborhood_size(centers, (height, width), radius) == count
+    assert count_center_neighborhood_size(np.array(centers, dtype=int).reshape(-1, 2), (height, width), radius) == count
+
+def test_center_list_wraparound():
+    X = random_grid(10, 13, 0.05, 4)
+    centers = np.argwhere(X)
+    assert count_center_neighborhood_size(centers, X.shape, 3, wraparound=True) == \
+        count_positive_neighborhood_size(X, 3, wraparound=True)
+
+@pytest.mark.parametrize(
+    "centers",
+    [[(11, 0)], [(0, -1)], [(1, 2, 3)], [(0.5, 1)]],
+    ids=["row_out_of_bounds", "negative", "wrong_width", "not_integer"],
+)
+def test_center_list_rejects_bad_centers(centers):
+    with pytest.raises(ValueError):
+        count_center_neighborhood_size(centers, (11, 11), 2)
+
+@pytest.mark.parametrize(
+    "count",
+    [
+        lambda X: count_positive_neighborhood_size_tiled(X, -1),
+        lambda X: count_positive_neighborhood_size_clustered(X, -1),
+        lambda X: count_positive_neighborhood_size_batch(X[None], -1),
+        lambda X: count_positive_neighborhood_size_batch(X[None], [-1]),
+        lambda X: count_positive_neighborhood_size_ragged([X], -1),
+        lambda X: count_many([X, X], -1, workers=2),
+        lambda X: list(iter_positive_neighborhood_counts(X, X.shape[1], -1)),
+        lambda X: CoverageIndex.from_array(X, -1),
+        lambda X: count_positive_neighborhood_sizes(X, [2, -1]),
+    ],
+    ids=["tiled", "clustered", "batch", "batch_per_grid", "ragged", "many", "streaming", "index", "curve"],
+)
+def test_negative_radius_is_rejected_everywhere(count):
+    with pytest.raises(ValueError, match="radi"):
+        count(random_grid(11, 11, 0.1, 0))
+
+@pytest.mark.parametrize("method", ("auto",) + ENGINES)
+def test_negative_radius_is_rejected(method):
+    X = random_grid(11, 11, 0.1, 0)
+
+    with pytest.raises(ValueError, match="radius"):
+        count_positive_neighborhood_size(X, -1, method=method)
+    with pytest.raises(ValueError, match="radius"):
+        count_center_neighborhood_size(np.argwhere(X), X.shape, -1, method=method)
+
+## Engine dispatch
+
+@pytest.mark.parametrize("method", ["sets", "dense", "packed", "distance", "intervals", "sweep", "imos"])
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_forced_methods_agree(method, wraparound):
+    X = random_grid(15, 12, 0.05, 7)
+    centers = np.argwhere(X)
+    expected = count_positive_neighborhood_size(X, 3, wraparound=wraparound, method="sets")
+
+    assert count_positive_neighborhood_size(X, 3, wraparound=wraparound, method=method) == expected
+    assert count_center_neighborhood_size(centers, X.shape, 3, wraparound=wraparound, method=method) == expected
+
+def test_unknown_method():
+    X = centers_to_array([(5, 5)], 11, 11)
+    with pytest.raises(ValueError):
+        count_positive_neighborhood_size(X, 3, method="magic")
+    with pytest.raises(ValueError):
+        count_center_neighborhood_size([(5, 5)], (11, 11), 3, method="magic")
+
+@pytest.mark.parametrize(
+    "size,n_centers,radius,expected",
+    [
+        ((10 ** 6, 10 ** 6), 10 ** 5, 1000, {"sweep"}),
+        ((4000, 4000), 10 ** 4, 500, {"distance", "imos"}),
+        ((4000, 4000), 10 ** 6, 2, {"dense", "packed"}),
+        ((40000, 40000), 16 * 10 ** 6, 100, {"dense", "packed", "distance"}),
+    ],
+    ids=["huge_sparse", "large_radius", "dense_small_radius", "memory_bound"],
+)
+def test_dispatch_choice(size, n_centers, radius, expected):
+    from src.manhattan import _ENGINE_MEMORY_ALLOWANCE, _ENGINE_MEMORY_PER_CELL, _choose_engine, _engine_memory
+
+    method = _choose_engine(size, n_centers, radius)
+    assert method in expected
+
+    # Faster engines like imos would need tens of GB on the last grid, far more than the grid itself
+    limit = _ENGINE_MEMORY_PER_CELL * size[0] * size[1] + _ENGINE_MEMORY_ALLOWANCE
+    assert _engine_memory(method, size, n_centers, radius) <= limit
+
+## Dispatcher calibration
+
+def test_calibration_round_trip(tmp_path, monkeypatch):
+    from src import manhattan
+    from src.calibrate import calibrate, main
+
+    monkeypatch.setattr(manhattan, "_ENGINE_COSTS", dict(manhattan._ENGINE_COSTS))
+
+    costs = calibrate([(20, 20, 0.05, 2)], repeats=1)
+    assert set(costs) == set(manhattan.ENGINES) | {"step", "isolation"}
+    assert all(cost > 0 for cost in costs.values())
+
+    path = str(tmp_path / "costs.json")
+    main(["--output", path, "--quick", "--repeats", "1"])
+
+    loaded = manhattan.load_engine_costs(path)
+    assert loaded == manhattan._ENGINE_COSTS
+    with open(path) as f:
+        assert json.load(f)["engine_costs"] == loaded
+
+def test_malformed_calibration_is_ignored(tmp_path, monkeypatch):
+    from src import manhattan
+
+    monkeypatch.setattr(manhattan, "_ENGINE_COSTS", dict(manhattan._ENGINE_COSTS))
+    before = dict(manhattan._ENGINE_COSTS)
+
+    path = tmp_path / "costs.json"
+    path.write_text('{"engine_costs": {"dense": -1}}')
+
+    with pytest.warns(UserWarning):
+        assert manhattan.load_engine_costs(str(path)) == before
+
+    assert manhattan.load_engine_costs(str(tmp_path / "missing.json")) == before
+
+## Batches of grids
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_batch_matches_single(wraparound):
+    X = np.stack([random_grid(9, 14, 0.04, seed) for seed in range(6)])
+    X[2] = 0
+    radii = np.array([0, 1, 50, 3, 7, 2])
+
+    expected = [count_positive_neighborhood_size(x, r, wraparound=wraparound) for x, r in zip(X, radii)]
+    assert list(count_positive_neighborhood_size_batch(X, radii, wraparound=wraparound)) == expected
+
+    expected = [count_positive_neighborhood_size(x, 3, wraparound=wraparound) for x in X]
+    assert list(count_positive_neighborhood_size_batch(X, 3, wraparound=wraparound)) == expected
+
+def test_batch_rejects_bad_shapes():
+    with pytest.raises(ValueError):
+        count_positive_neighborhood_size_batch(np.zeros((11, 11)), 3)
+    with pytest.raises(ValueError):
+        count_positive_neighborhood_size_batch(np.zeros((4, 11, 11)), [1, 2])
+
+@pytest.mark.parametrize("radius", [0, 2, 5, 40])
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_ragged_matches_single(radius, wraparound):
+    rng = np.random.default_rng(radius)
+    grids = [random_grid(int(h), int(w), 0.05, seed) for seed, (h, w) in enumerate(rng.integers(1, 25, (12, 2)))]
+    grids.append(np.zeros((7, 9)))
+
+    expected = [count_positive_neighborhood_size(grid, radius, wraparound=wraparound) for grid in grids]
+    assert list(count_positive_neighborhood_size_ragged(grids, radius, wraparound=wraparound)) == expected
+
+def test_ragged_packing_leaves_guard_bands():
+    from src.batch import _shelf_pack
+
+    shapes = [(5, 8), (3, 3), (9, 2), (4, 7), (1, 1)]
+    positions, (height, width) = _shelf_pack(shapes, gap=2)
+
+    boxes = [(top, left, top + h + 2, left + w + 2) for (top, left), (h, w) in zip(positions, shapes)]
+    assert all(bottom - 2 <= height and right - 2 <= width for _, _, bottom, right in boxes)
+
+    for (t1, l1, b1, r1), (t2, l2, b2, r2) in itertools.combinations(boxes, 2):
+        assert b1 <= t2 or b2 <= t1 or r1 <= l2 or r2 <= l1
+
+## Process pool
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_count_many_matches_single(workers):
+    rng = np.random.default_rng(5)
+    grids = [random_grid(int(h), int(w), 0.05, seed) for seed, (h, w) in enumerate(rng.integers(1, 30, (9, 2)))]
+
+    for wraparound in (False, True):
+        expected = [count_positive_neighborhood_size(grid, 3, wraparound=wraparound) for grid in grids]
+        assert list(count_many(grids, 3, wraparound=wraparound, workers=workers)) == expected
+
+def test_count_many_rejects_bad_input():
+    with pytest.raises(ValueError):
+        count_many([np.zeros(5)], 2)
+    with pytest.raises(ValueError):
+        count_many([np.zeros((5, 5))], 2, workers=0)
+
+## Threaded bands
+
+@pytest.mark.parametrize("band_rows", [None, 1, 3, 7, 100])
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_tiled_matches_single(band_rows, wraparound):
+    for seed, (height, width, radius) in enumerate([(23, 17, 3), (9, 30, 12), (40, 5, 1), (6, 6, 0)]):
+        X = random_grid(height, width, 0.03, seed)
+        expected = count_positive_neighborhood_size(X, radius, wraparound=wraparound)
+        count = count_positive_neighborhood_size_tiled(X, radius, wraparound=wraparound, workers=3, band_rows=band_rows)
+        assert count == expected
+
+## Saturation
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_saturated_radius_skips_engines(wraparound, monkeypatch):
+    from src import manhattan
+
+    def fail(*args, **kwargs):
+        raise AssertionError("engine should not run")
+
+    monkeypatch.setattr(manhattan, "_run_engine", fail)
+
+    X = centers_to_array([(5, 5)], 11, 11)
+    assert count_positive_neighborhood_size(X, 10, wraparound=wraparound) == 121
+    assert count_positive_neighborhood_size(X, 1000, wraparound=wraparound, method="sets") == 121
+    assert count_center_neighborhood_size([(0, 0)], (11, 11), 20, wraparound=wraparound) == 121
+    assert count_positive_neighborhood_size(np.zeros((11, 11)), 1000, wraparound=wraparound) == 0
+
+    # A corner center needs the full diagonal without wraparound
+    if not wraparound:
+        with pytest.raises(AssertionError):
+            count_center_neighborhood_size([(0, 0)], (11, 11), 19)
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_saturation_check_is_exact_at_threshold(wraparound):
+    from src.manhattan import _saturated
+
+    for seed in range(20):
+        X = random_grid(7, 10, 0.05, seed)
+        rows, cols = np.nonzero(X)
+        if len(rows) == 0:
+            continue
+
+        for radius in range(4, 17):
+            if _saturated(rows, cols, X.shape, radius, wraparound):
+                assert reference_count(X, radius, wraparound) == X.size
+
+
+    # A single center saturates the clipped grid exactly at the distance to its farthest corner
+    if not wraparound:
+        for row, col in [(0, 0), (3, 4), (6, 2)]:
+            X = np.zeros((7, 10), dtype=int)
+            X[row, col] = 1
+            radius = max(row, 6 - row) + max(col, 9 - col)
+            assert _saturated(np.array([row]), np.array([col]), X.shape, radius)
+            assert not _saturated(np.array([row]), np.array([col]), X.shape, radius - 1)
+            assert reference_count(X, radius - 1) < X.size
+
+## Isolated centers
+
+@pytest.mark.parametrize("height,width", [(1, 1), (1, 7), (5, 3), (9, 12)])
+def test_clipped_diamond_area(height, width):
+    from src.manhattan import _clipped_diamond_area
+
+    rows, cols = (axis.ravel() for axis in np.indices((height, width)))
+
+    for radius in range(0, 25):
+        areas = _clipped_diamond_area(rows, cols, (height, width), radius)
+        for row, col, area in zip(rows, cols, areas):
+            assert area == len(brute_neighborhood((row, col), radius, True, (height, width))) + 1
+
+def test_overlap_pairs():
+    from src.manhattan import _overlap_pairs
+
+    rng = np.random.default_rng(3)
+
+    for _ in range(100):
+        n, radius = rng.integers(1, 40), int(rng.integers(0, 10))
+        rows, cols = rng.integers(0, 60, n), rng.integers(0, 80, n)
+
+        i, j = _overlap_pairs(rows, cols, radius)
+        expected = {
+            (a, b) for a in range(n) for b in range(a + 1, n)
+            if abs(rows[a] - rows[b]) + abs(cols[a] - cols[b]) <= 2 * radius
+        }
+        assert len(i) == len(expected)
+        assert {(min(a, b), max(a, b)) for a, b in zip(i, j)} == expected
+
+    assert _overlap_pairs(np.zeros(10, dtype=int), np.arange(10), 3, max_pairs=20) is None
+
+def test_isolated_centers_are_split_off(monkeypatch):
+    from src import manhattan
+
+    # Make the split always look worth it
+    costs = dict(manhattan._ENGINE_COSTS, step=1e-12, isolation=1e-12)
+    monkeypatch.setattr(manhattan, "_ENGINE_COSTS", costs)
+
+    areas = []
+    clipped_area = manhattan._clipped_diamond_area
+    monkeypatch.setattr(
+        manhattan, "_clipped_diamond_area", lambda *args: areas.append(len(args[0])) or clipped_area(*args)
+    )
+
+    # Two far apart centers, one against an edge, and a cluster of three
+    centers = [(0, 3), (20, 20), (40, 5), (41, 7), (43, 6)]
+    X = np.zeros((45, 30), dtype=int)
+    X[tuple(np.array(centers).T)] = 1
+
+    # The cluster's centers are 3 or 4 apart, so only radii from 2 on make them overlap
+    for radius, isolated in [(0, 5), (1, 5), (2, 2), (4, 2)]:
+        assert count_positive_neighborhood_size(X, radius) == reference_count(X, radius)
+        assert areas[-1] == isolated
+
+        # A repeated center overlaps its copy
+        assert count_center_neighborhood_size(centers + [(20, 20)], X.shape, radius) == reference_count(X, radius)
+        assert areas[-1] == isolated - 1
+
+    for seed in range(5):
+        X = random_grid(40, 50, 0.01, seed)
+        for radius in (1, 3, 6):
+            assert count_positive_neighborhood_size(X, radius) == reference_count(X, radius)
+
+def test_overlap_components():
+    from src.manhattan import _overlap_components
+
+    rng = np.random.default_rng(8)
+
+    for _ in range(50):
+        n, radius = rng.integers(1, 60), int(rng.integers(0, 6))
+        rows, cols = rng.integers(0, 50, n), rng.integers(0, 50, n)
+
+        # Plain flood fill over the overlap graph
+        expected = np.full(n, -1)
+        for start in range(n):
+            if expected[start] >= 0:
+                continue
+            expected[start], stack = start, [start]
+            while stack:
+                a = stack.pop()
+                for b in range(n):
+                    if expected[b] < 0 and abs(rows[a] - rows[b]) + abs(cols[a] - cols[b]) <= 2 * radius:
+                        expected[b] = start
+                        stack.append(b)
+
+        assert list(_overlap_components(rows, cols, radius)) == list(expected)
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_clustered_matches_single(workers, monkeypatch):
+    from src import parallel
+
+    # Small chunks so clusters are spread over many of them
+    monkeypatch.setattr(parallel, "_CLUSTER_CHUNK_CENTERS", 3)
+
+    for seed in range(5):
+        X = random_grid(45, 60, 0.01 * (seed + 1), seed)
+        for radius in (0, 1, 3, 8, 100):
+            count = count_positive_neighborhood_size_clustered(X, radius, workers=workers)
+            assert count == (reference_count(X, radius) if radius < 100 else X.size)
+
+    X = random_grid(20, 15, 0.05, 2)
+    assert count_positive_neighborhood_size_clustered(X, 3, wraparound=True) == reference_count(X, 3, True)
+    assert count_positive_neighborhood_size_clustered(np.zeros((5, 5)), 3) == 0
+
+    with pytest.raises(ValueError):
+        count_positive_neighborhood_size_clustered(X, 3, workers=0)
+
+def test_clustered_falls_back_on_crowded_grids(monkeypatch):
+    from src import parallel
+
+    def fail(*args, **kwargs):
+        raise AssertionError("clusters should not be counted")
+
+    monkeypatch.setattr(parallel, "_count_cluster_chunk", fail)
+
+    # Thousands of positives share each (2r + 1)-wide bucket, listing their candidate pairs would take gigabytes
+    X = random_grid(400, 400, 0.05, 0)
+    assert count_positive_neighborhood_size_clustered(X, 30) == count_positive_neighborhood_size(X, 30)
+
+## Out of core
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_memmap_streams_in_bands(tmp_path, monkeypatch, wraparound):
+    from src import manhattan
+
+    X = random_grid(37, 19, 0.02, 1)
+    path = tmp_path / "grid.npy"
+    np.save(path, X)
+
+    # Force many small bands
+    monkeypatch.setattr(manhattan, "_STREAM_BLOCK_CELLS", 5 * 19)
+
+    for radius in (0, 2, 9, 60):
+        expected = count_positive_neighborhood_size(X, radius, wraparound=wraparound)
+        assert count_positive_neighborhood_size(str(path), radius, wraparound=wraparound) == expected
+        assert count_positive_neighborhood_size(path, radius, wraparound=wraparound) == expected
+        assert count_positive_neighborhood_size(np.load(path, mmap_mode="r"), radius, wraparound=wraparound) == expected
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_memmap_bands_stay_taller_than_halo(tmp_path, monkeypatch, wraparound):
+    from src import manhattan
+
+    X = random_grid(200, 40, 0.01, 2)
+    path = tmp_path / "grid.npy"
+    np.save(path, X)
+
+    # Budget of 3 rows, far below the 2 * radius rows of halo around every band
+    monkeypatch.setattr(manhattan, "_STREAM_BLOCK_CELLS", 3 * 40)
+
+    bands = []
+    count_row_band = manhattan._count_row_band
+
+    def record_band(X, first, stop, *args):
+        bands.append(stop - first)
+        return count_row_band(X, first, stop, *args)
+
+    monkeypatch.setattr(manhattan, "_count_row_band", record_band)
+
+    expected = count_positive_neighborhood_size(X, 10, wraparound=wraparound)
+    assert count_positive_neighborhood_size(np.load(path, mmap_mode="r"), 10, wraparound=wraparound) == expected
+    assert len(bands) == 10 and min(bands) == 20
+
+## Streaming rows
+
+@pytest.mark.parametrize("radius", [0, 1, 3, 8, 50])
+def test_streaming_matches_single(radius):
+    for seed, (height, width) in enumerate([(23, 17), (1, 9), (4, 30), (40, 1)]):
+        X = random_grid(height, width, 0.05, seed)
+        expected = count_positive_neighborhood_size(X, radius)
+
+        counts = list(iter_positive_neighborhood_counts(iter(X), width, radius))
+        assert len(counts) == height + 1
+        assert counts[-1] == expected
+        assert counts == sorted(counts)
+
+        blocks = [X[i:i + 5] for i in range(0, height, 5)]
+        assert list(iter_positive_neighborhood_counts(blocks, width, radius))[-1] == expected
+
+def test_streaming_running_counts():
+    X = centers_to_array([(0, 2), (4, 2)], 5, 6)
+    assert list(iter_positive_neighborhood_counts(X, 5, 1)) == [0, 3, 4, 4, 5, 8, 9]
+
+def test_streaming_rejects_wrong_width():
+    with pytest.raises(ValueError):
+        list(iter_positive_neighborhood_counts([np.zeros(4)], 5, 1))
+
+def test_streaming_huge_radius_on_few_rows():
+    # The ring buffer only holds the rows that arrived, not 2 * radius + 1 of them
+    X = random_grid(3, 2000, 0.01, 6)
+    assert list(iter_positive_neighborhood_counts(iter(X), 2000, 10 ** 6))[-1] == 6000
+    assert list(iter_positive_neighborhood_counts(iter(np.zeros((3, 2000))), 2000, 10 ** 6)) == [0, 0, 0, 0]
+
+## Incremental coverage
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+@pytest.mark.parametrize("height,width,radius", [(11, 11, 3), (7, 20, 2), (5, 4, 6), (12, 9, 0)])
+def test_coverage_index_tracks_changes(height, width, radius, wraparound):
+    rng = np.random.default_rng(height * width + radius)
+    X = random_grid(height, width, 0.1, radius)
+    index = CoverageIndex.from_array(X, radius, wraparound=wraparound)
+    assert index.count == count_positive_neighborhood_size(X, radius, wraparound=wraparound)
+
+    for _ in range(40):
+        row, col = rng.integers(height), rng.integers(width)
+        if X[row, col]:
+            index.remove_center(row, col)
+        else:
+            index.add_center(row, col)
+        X[row, col] = 1 - X[row, col]
+
+        assert index.count == count_positive_neighborhood_size(X, radius, wraparound=wraparound)
+
+    np.testing.assert_array_equal(index.coverage, CoverageIndex.from_array(X, radius, wraparound).coverage)
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+@pytest.mark.parametrize("height,width,radius", [(8, 200000, 3), (3, 5000, 40), (6, 5, 9)])
+def test_coverage_index_from_array_on_any_shape(height, width, radius, wraparound):
+    X = random_grid(height, width, 0.001 if width > 1000 else 0.2, 1)
+    index = CoverageIndex.from_array(X, radius, wraparound=wraparound)
+    assert index.count == count_positive_neighborhood_size(X, radius, wraparound=wraparound)
+
+    # Painting every center on its own gives the same coverage
+    expected = CoverageIndex(X.shape, radius, wraparound)
+    for row, col in zip(*np.nonzero(X)):
+        expected.add_center(row, col)
+    np.testing.assert_array_equal(index.coverage, expected.coverage)
+
+def test_coverage_index_rejects_bad_changes():
+    index = CoverageIndex((11, 11), 2)
+    index.add_center(5, 5)
+    assert index.count == 13
+
+    with pytest.raises(ValueError):
+        index.add_center(5, 5)
+    with pytest.raises(ValueError):
+        index.remove_center(4, 4)
+    with pytest.raises(ValueError):
+        index.add_center(11, 0)
+
+    index.remove_center(5, 5)
+    assert index.count == 0
+
+@pytest.mark.parametrize("flips", [1, 5, 200])
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_frame_updates(flips, wraparound):
+    rng = np.random.default_rng(flips)
+    frame = random_grid(30, 25, 0.02, flips)
+    index = CoverageIndex.from_array(frame, 3, wraparound=wraparound)
+
+    for _ in range(10):
+        following = frame.copy()
+        rows, cols = rng.integers(30, size=flips), rng.integers(25, size=flips)
+        following[rows, cols] = 1 - following[rows, cols]
+
+        count = update_coverage(frame, following, index)
+        assert count == index.count == count_positive_neighborhood_size(following, 3, wraparound=wraparound)
+
+        frame = following
+
+    np.testing.assert_array_equal(index.coverage, CoverageIndex.from_array(frame, 3, wraparound).coverage)
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_frame_update_rebuilds_long_thin_grid(wraparound, monkeypatch):
+    from src import incremental
+
+    frame = random_grid(8, 200000, 0.0005, 3)
+    index = CoverageIndex.from_array(frame, 4, wraparound=wraparound)
+
+    rebuilds = []
+    from_array = CoverageIndex.from_array.__func__
+
+    def record_rebuild(cls, *args):
+        rebuilds.append(args)
+        return from_array(cls, *args)
+
+    monkeypatch.setattr(incremental.CoverageIndex, "from_array", classmethod(record_rebuild))
+
+    # Flipping a whole row changes far too many cells to paint them one diamond at a time
+    following = frame.copy()
+    following[3] = 1 - following[3]
+
+    count = update_coverage(frame, following, index)
+    assert len(rebuilds) == 1
+    assert count == index.count == count_positive_neighborhood_size(following, 4, wraparound=wraparound)
+
+def test_frame_update_rejects_wrong_shape():
+    index = CoverageIndex((11, 11), 2)
+    with pytest.raises(ValueError):
+        update_coverage(np.zeros((11, 11)), np.zeros((11, 12)), index)
+
+## Neighborhood generation
+
+def brute_neighborhood(coor, radius, prune, size):
+    x, y = coor
+    return {
+        (x + d_x, y + d_y)
+        for d_x in range(-radius, radius + 1)
+        for d_y in range(-radius, radius + 1)
+        if 0 < abs(d_x) + abs(d_y) <= radius
+        and (not prune or (0 <= x + d_x < size[0] and 0 <= y + d_y < size[1]))
+    }
+
+@pytest.mark.parametrize("prune", [True, False])
+@pytest.mark.parametrize("coor,radius,size", [
+    ((5, 5), 3, (11, 11)),
+    ((0, 10), 4, (11, 11)),
+    ((0, 0), 0, (1, 1)),
+    ((3, 0), 2, (10, 1)),
+    ((2, 3), 30, (5, 7)),
+])
+def test_manhattan_neighborhood(coor, radius, size, prune):
+    from src.manhattan import manhattan_neighborhood
+    assert manhattan_neighborhood(coor, radius, prune_wraparound=prune, size=size) == \
+        brute_neighborhood(coor, radius, prune, size)
+
+@pytest.mark.parametrize("wraparound", [False, True], ids=["clip", "wrap"])
+def test_clipped_enumeration_skips_off_grid_cells(wraparound, monkeypatch):
+    from src import manhattan
+
+    # Cells are built from clipped row intervals, the radius 1000 stencil of ~2M cells is never needed
+    monkeypatch.setattr(manhattan, "_stencils", manhattan._StencilCache(maxsize=2))
+
+    assert manhattan.manhattan_neighborhood((0, 10), 1000, prune_wraparound=True, size=(11, 11)) == \
+        {(x, y) for x in range(11) for y in range(11)} - {(0, 10)}
+
+    X = centers_to_array([(0, 0), (5, 5), (10, 3)], 11, 11)
+    assert manhattan._count_sets(X, 1000, wraparound) == 121
+    assert 1000 not in manhattan._stencils._stencils
+
+    # Interior centers still go through the stencil, edge ones through intervals
+    X = random_grid(30, 40, 0.1, 0)
+    assert manhattan._count_sets(X, 5, wraparound) == reference_count(X, 5, wraparound)
+    assert 5 in manhattan._stencils._stencils
+
+def test_stencil_cache(monkeypatch):
+    from src import diamond_offsets, set_stencil_cache_size
+    from src import manhattan
+
+    monkeypatch.setattr(manhattan, "_stencils", manhattan._StencilCache(maxsize=2))
+
+    stencil = diamond_offsets(3)
+    assert len(stencil) == 25
+    assert set(map(tuple, stencil.tolist())) == brute_neighborhood((0, 0), 3, False, None) | {(0, 0)}
+    assert diamond_offsets(3) is stencil
+    with pytest.raises(ValueError):
+        stencil[0, 0] = 7
+
+    diamond_offsets(4)
+    diamond_offsets(3)
+    diamond_offsets(5)  # evicts 4, the least recently used
+    assert list(manhattan._stencils._stencils) == [3, 5]
+
+    set_stencil_cache_size(1)
+    assert list(manhattan._stencils._stencils) == [5]